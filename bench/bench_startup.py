@@ -0,0 +1,139 @@
+# bench/bench_startup.py
+"""
+Arranque en frío de una corrida chica (dry run, como `python src/main.py --from ... --to ...`):
+cuánto se va en importar, en armar el servicio de Gmail y en la corrida en sí.
+
+    python bench/bench_startup.py                 # 7 arranques, mediana
+    python bench/bench_startup.py --messages 50 --repeat 15
+    python bench/bench_startup.py --save          # guarda los resultados como baseline
+
+Cada arranque es un proceso nuevo (nada importado ni cacheado). El servicio se arma
+con get_gmail_service() de verdad (token.pickle + discovery document) pero con un token
+falso; la corrida usa el Gmail falso de fake_gmail.py. No necesita cuenta ni red.
+Compara contra bench/startup_baselines.json y sale con código 1 si el total sube más
+que --max-regression.
+"""
+import time
+T_START = time.perf_counter()
+
+import argparse, json, os, shutil, statistics, subprocess, sys, tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+BASELINES_PATH = os.path.join(BENCH_DIR, "startup_baselines.json")
+DATE_FROM, DATE_TO = "2025-08-01", "2025-08-31"
+PHASES = ("interpreter_s", "import_s", "service_s", "run_s", "total_s")
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Benchmark de arranque en frío (corrida chica)")
+    ap.add_argument("--messages", type=int, default=20, help="Mensajes en el buzón falso (default: 20)")
+    ap.add_argument("--repeat", type=int, default=7, help="Arranques a medir (se informa la mediana)")
+    ap.add_argument("--save", action="store_true", help="Guardar resultados en bench/startup_baselines.json")
+    ap.add_argument("--max-regression", type=float, default=0.25,
+                    help="Aumento máximo del tiempo total aceptado frente al baseline (default: 0.25)")
+    ap.add_argument("--one", default=None, help=argparse.SUPPRESS)  # uso interno: un arranque (ruta del token)
+    return ap.parse_args()
+
+
+def bench_one(args) -> dict:
+    """Un arranque: se llama en un proceso nuevo, en una carpeta temporal."""
+    token_path = args.one
+    os.chdir(os.path.dirname(token_path))
+
+    t0 = time.perf_counter()
+    sys.path[:0] = [os.path.join(ROOT, "src"), BENCH_DIR]
+    import yaml
+    import main  # noqa: F401  (lo mismo que importa el CLI)
+    from gmail_client import get_gmail_service
+    from pipeline import run_pipeline
+    t1 = time.perf_counter()
+    get_gmail_service(token_path=token_path)
+    t2 = time.perf_counter()
+
+    from fake_gmail import FakeGmail
+    with open(os.path.join(ROOT, "config", "config.yaml"), "r", encoding="utf-8") as f:
+        cfg = yaml.safe_load(f)
+    cfg["label"] = None
+    gmail = FakeGmail(n=args.messages, start=DATE_FROM, days=31)
+    t3 = time.perf_counter()
+    summary = run_pipeline(gmail, cfg, DATE_FROM, DATE_TO, download=False)
+    t4 = time.perf_counter()
+    return {
+        "import_s": t1 - t0,
+        "service_s": t2 - t1,
+        "run_s": t4 - t3,
+        "messages": summary["messages"],
+        "modules": len(sys.modules),
+        "t_end": t4 - T_START,  # desde que arrancó este script
+    }
+
+
+def _fake_token(path):
+    """token.pickle con credenciales que parecen válidas (no vencen, no se usan contra Google)."""
+    import pickle
+    from google.oauth2.credentials import Credentials
+    with open(path, "wb") as f:
+        pickle.dump(Credentials(token="bench"), f)
+
+
+def run_child(args, token_path) -> dict:
+    work = tempfile.mkdtemp(prefix="dte-startup-")
+    token = os.path.join(work, "token.pickle")
+    shutil.copyfile(token_path, token)
+    t0 = time.perf_counter()
+    proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--one", token, "--messages", str(args.messages)],
+                          capture_output=True, text=True)
+    wall = time.perf_counter() - t0
+    if proc.returncode != 0:
+        sys.stderr.write(proc.stderr)
+        raise SystemExit("Falló el arranque")
+    res = json.loads(proc.stdout.strip().splitlines()[-1])
+    # lo que no pasa dentro del script: levantar el intérprete
+    res["interpreter_s"] = wall - res.pop("t_end")
+    res["total_s"] = wall
+    shutil.rmtree(work, ignore_errors=True)
+    return res
+
+
+def main():
+    args = parse_args()
+    if args.one:
+        print(json.dumps(bench_one(args)))
+        return
+
+    with tempfile.TemporaryDirectory(prefix="dte-startup-") as tmp:
+        token_path = os.path.join(tmp, "token.pickle")
+        _fake_token(token_path)
+        runs = [run_child(args, token_path) for _ in range(args.repeat)]
+    result = {k: round(statistics.median(r[k] for r in runs), 4) for k in PHASES}
+    result["modules"] = runs[-1]["modules"]
+
+    baselines = {}
+    if os.path.exists(BASELINES_PATH):
+        with open(BASELINES_PATH, "r", encoding="utf-8") as f:
+            baselines = json.load(f)
+    params = {"messages": args.messages}
+    base = baselines.get("result") if baselines.get("params") == params else None
+
+    print(f"{'fase':>14} {'mediana s':>10}   vs baseline")
+    for k in PHASES:
+        delta = f"{result[k] - base[k]:+.3f} s" if base else ""
+        print(f"{k:>14} {result[k]:>10.3f}   {delta}")
+    print(f"{'módulos':>14} {result['modules']:>10}")
+
+    regression = base and result["total_s"] > base["total_s"] * (1 + args.max_regression)
+    if regression:
+        print(f"REGRESIÓN: el arranque total pasó de {base['total_s']:.3f}s a {result['total_s']:.3f}s")
+    if baselines and not base:
+        print("(baseline guardado con otros parámetros: no se compara)")
+    if args.save:
+        with open(BASELINES_PATH, "w", encoding="utf-8") as f:
+            json.dump({"params": params, "python": sys.version.split()[0], "result": result}, f, indent=2)
+        print(f"Baseline guardado en {BASELINES_PATH}")
+    if regression and not args.save:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+# bench/fake_gmail.py
+"""
+Servicio Gmail falso para medir el pipeline sin cuenta real.
+
+Imita lo que devuelve get_gmail_service() en lo que usa el bot:
+messages.list (paginado y filtrado por after:/before:), messages.get
+(full / metadata), attachments.get, batch, send (subida reanudable),
+getProfile, labels.list e history.list.
+
+El buzón es sintético y determinístico (misma semilla = mismo buzón). Los bytes
+de los adjuntos se generan al pedirlos, así un buzón de 10k mensajes no ocupa
+memoria. Se puede simular latencia por llamada, errores 5xx y 429.
+"""
+import base64, json, random, threading, time
+from datetime import datetime, timezone
+import httplib2
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaUploadProgress
+
+SENDERS = [
+    ("Distribuidora El Sol", "facturacion@elsol.com.sv"),
+    ("Ferretería Central", "dte@ferrecentral.com"),
+    ("Servicios Técnicos SA de CV", "no-reply@servitec.sv"),
+    ("Supermercados La Colonia", "facturas@lacolonia.com.sv"),
+    ("Telecom Móvil", "efactura@telecom.sv"),
+    ("Gasolinera Uno", "dte@gasuno.com"),
+    ("Papelería Escolar", "ventas@papeleria.sv"),
+]
+SUBJECTS = [
+    "Factura electrónica DTE {n}",
+    "Documento Tributario Electrónico No. {n}",
+    "Facturación electrónica - comprobante {n}",
+]
+
+
+def _http_error(status: int, reason: str = "", retry_after: str = None) -> HttpError:
+    info = {"status": status}
+    if retry_after is not None:
+        info["retry-after"] = retry_after
+    body = {"error": {"code": status, "errors": [{"reason": reason}] if reason else []}}
+    return HttpError(httplib2.Response(info), json.dumps(body).encode("utf-8"))
+
+
+class FakeGmail:
+    """
+    n: mensajes en el buzón, repartidos entre start y start + days.
+    latency: segundos por llamada (un batch cuenta como una llamada).
+    error_rate / throttle_rate: probabilidad de 503 / 429 por petición.
+    batch_error_rate: probabilidad de que un batch falle entero (mitad 429, mitad 503).
+    dup_rate: fracción de mensajes que reenvían una factura anterior (mismo PDF/JSON).
+    pdf_kb: mediana del tamaño de los PDF (distribución lognormal, 8 KB - 2 MB).
+    """
+
+    def __init__(self, n=1000, seed=1, latency=0.0, error_rate=0.0, throttle_rate=0.0,
+                 batch_error_rate=0.0, dup_rate=0.02, pdf_kb=80, start="2025-08-01", days=31):
+        self.seed = seed
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.batch_error_rate = batch_error_rate
+        self.calls = {}
+        self.sent = []
+        self.history_id = 1000 + n
+        self._lock = threading.Lock()
+        self._rnd = random.Random(seed ^ 0x5EED)
+        self._http = type("FakeHttp", (), {"credentials": None})()
+
+        rnd = random.Random(seed)
+        t0 = datetime.fromisoformat(start).replace(tzinfo=timezone.utc)
+        span_ms = days * 86400 * 1000
+        self.msgs = {}      # id -> mensaje en formato full
+        self.atts = {}      # attachment_id -> (semilla de contenido, tamaño, tipo)
+        for i in range(n):
+            mid = f"{0x18a00000000 + i:x}"
+            when = int(t0.timestamp() * 1000) + rnd.randrange(span_ms)
+            name, email = SENDERS[i % len(SENDERS)]
+            src = i
+            if i and rnd.random() < dup_rate:
+                src = rnd.randrange(i)  # reenvío de una factura anterior
+            # el tamaño depende de la factura (src): un reenvío trae el mismo PDF
+            pdf_kb_i = random.Random(seed * 31 + src).lognormvariate(0, 0.8) * pdf_kb
+            pdf_size = int(min(2048, max(8, pdf_kb_i)) * 1024)
+            parts = [{"partId": "0", "mimeType": "multipart/alternative", "filename": "", "body": {"size": 0},
+                      "parts": [{"partId": "0.0", "mimeType": "text/plain", "filename": "", "body": {"size": 120}},
+                                {"partId": "0.1", "mimeType": "text/html", "filename": "", "body": {"size": 900}}]}]
+            for j, (ext, mime) in enumerate((("pdf", "application/pdf"), ("json", "application/json"))):
+                aid = f"ANGjd{mid}{j}"
+                size = pdf_size if ext == "pdf" else len(self._dte_json(src))
+                self.atts[aid] = (src, size, ext)
+                parts.append({"partId": str(j + 1), "mimeType": mime, "filename": f"DTE-{src:06d}.{ext}",
+                              "body": {"attachmentId": aid, "size": size}})
+            self.msgs[mid] = {
+                "id": mid,
+                "threadId": mid,
+                "labelIds": ["INBOX", "UNREAD"],
+                "internalDate": str(when),
+                "snippet": "Adjunto su documento tributario electrónico",
+                "sizeEstimate": sum(p["body"]["size"] for p in parts) * 4 // 3,
+                "payload": {
+                    "partId": "",
+                    "mimeType": "multipart/mixed",
+                    "headers": [
+                        {"name": "From", "value": f'"{name}" <{email}>'},
+                        {"name": "To", "value": "yo@miempresa.com"},
+                        {"name": "Subject", "value": SUBJECTS[i % len(SUBJECTS)].format(n=src)},
+                        {"name": "Date", "value": datetime.fromtimestamp(when / 1000, timezone.utc).strftime("%a, %d %b %Y %H:%M:%S +0000")},
+                    ],
+                    "body": {"size": 0},
+                    "parts": parts,
+                },
+            }
+        # como Gmail: del más nuevo al más viejo
+        self._order = sorted(self.msgs, key=lambda m: int(self.msgs[m]["internalDate"]), reverse=True)
+
+    # --- contenido sintético ---
+    def _dte_json(self, src: int) -> bytes:
+        rnd = random.Random(self.seed * 1_000_003 + src)
+        name, _ = SENDERS[src % len(SENDERS)]
+        items = [{"numItem": k + 1, "descripcion": f"Producto {rnd.randrange(1000)}", "cantidad": rnd.randrange(1, 20),
+                  "precioUni": round(rnd.uniform(0.5, 200), 2)} for k in range(rnd.randrange(1, 25))]
+        total = round(sum(it["cantidad"] * it["precioUni"] for it in items), 2)
+        doc = {
+            "identificacion": {
+                "version": 1, "ambiente": "01", "tipoDte": "01",
+                "numeroControl": f"DTE-01-{src % 9999:04d}P001-{src:015d}",
+                "codigoGeneracion": f"{rnd.getrandbits(128):032X}",
+                "fecEmi": "2025-08-01",
+            },
+            "emisor": {"nit": f"0614{src % len(SENDERS):010d}", "nombre": name},
+            "receptor": {"nit": "06140000000000", "nombre": "Mi Empresa"},
+            "cuerpoDocumento": items,
+            "resumen": {"totalGravada": total, "totalIva": round(total * 0.13, 2), "totalPagar": round(total * 1.13, 2)},
+        }
+        return json.dumps(doc, ensure_ascii=False).encode("utf-8")
+
+    def attachment_bytes(self, attachment_id: str) -> bytes:
+        src, size, ext = self.atts[attachment_id]
+        if ext == "json":
+            return self._dte_json(src)
+        head = b"%PDF-1.4\n"
+        body = random.Random(self.seed * 7_919 + src).randbytes(size - len(head) - 6)
+        return head + body + b"\n%%EOF"
+
+    # --- simulación de red ---
+    def _call(self, endpoint: str, wait: bool = True):
+        with self._lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+            roll = self._rnd.random()
+        if wait and self.latency:
+            time.sleep(self.latency)
+        if roll < self.throttle_rate:
+            raise _http_error(429, "rateLimitExceeded", retry_after="0")
+        if roll < self.throttle_rate + self.error_rate:
+            raise _http_error(503, "backendError")
+
+    # --- recursos ---
+    def users(self):
+        return _Users(self)
+
+    def new_batch_http_request(self, callback=None):
+        return _Batch(self, callback)
+
+
+class _Request:
+    """Como googleapiclient.http.HttpRequest: no hace nada hasta execute()."""
+
+    def __init__(self, gmail, endpoint, fn):
+        self.gmail, self.endpoint, self.fn = gmail, endpoint, fn
+
+    def execute(self, http=None, num_retries=0):
+        return self._run()
+
+    def _run(self, wait=True):
+        self.gmail._call(self.endpoint, wait)
+        return self.fn()
+
+
+class _Users:
+    def __init__(self, g):
+        self.g = g
+
+    def messages(self):
+        return _Messages(self.g)
+
+    def labels(self):
+        return _Labels(self.g)
+
+    def history(self):
+        return _History(self.g)
+
+    def getProfile(self, userId="me"):
+        return _Request(self.g, "getProfile", lambda: {"emailAddress": "yo@miempresa.com",
+                                                      "historyId": str(self.g.history_id)})
+
+
+def _date_bounds(q: str):
+    """after:/before: de la query en milisegundos (UTC), como límites del listado."""
+    lo, hi = None, None
+    for tok in (q or "").split():
+        if tok.startswith(("after:", "before:")):
+            key, value = tok.split(":", 1)
+            ms = int(datetime.strptime(value, "%Y/%m/%d").replace(tzinfo=timezone.utc).timestamp() * 1000)
+            if key == "after":
+                lo = ms
+            else:
+                hi = ms
+    return lo, hi
+
+
+class _Messages:
+    def __init__(self, g):
+        self.g = g
+
+    def list(self, userId="me", q=None, maxResults=100, pageToken=None, **kw):
+        def run():
+            lo, hi = _date_bounds(q)
+            ids = [m for m in self.g._order
+                   if (lo is None or int(self.g.msgs[m]["internalDate"]) >= lo)
+                   and (hi is None or int(self.g.msgs[m]["internalDate"]) < hi)]
+            start = int(pageToken or 0)
+            page = ids[start:start + maxResults]
+            res = {"messages": [{"id": m, "threadId": m} for m in page], "resultSizeEstimate": len(ids)}
+            if start + maxResults < len(ids):
+                res["nextPageToken"] = str(start + maxResults)
+            return res
+        return _Request(self.g, "messages.list", run)
+
+    def get(self, userId="me", id=None, format="full", metadataHeaders=None, fields=None, **kw):
+        def run():
+            if id not in self.g.msgs:
+                raise _http_error(404, "notFound")
+            msg = json.loads(json.dumps(self.g.msgs[id]))
+            if format == "metadata":
+                wanted = {h.lower() for h in (metadataHeaders or [])}
+                headers = msg["payload"]["headers"]
+                msg["payload"] = {"headers": [h for h in headers if not wanted or h["name"].lower() in wanted]}
+            return msg
+        return _Request(self.g, "messages.get", run)
+
+    def attachments(self):
+        return _Attachments(self.g)
+
+    def send(self, userId="me", body=None, media_body=None):
+        return _SendRequest(self.g, body, media_body)
+
+
+class _Attachments:
+    def __init__(self, g):
+        self.g = g
+
+    def get(self, userId="me", messageId=None, id=None):
+        def run():
+            data = self.g.attachment_bytes(id)
+            return {"size": len(data), "data": base64.urlsafe_b64encode(data).decode("ascii")}
+        return _Request(self.g, "attachments.get", run)
+
+
+class _Labels:
+    def __init__(self, g):
+        self.g = g
+
+    def list(self, userId="me"):
+        return _Request(self.g, "labels.list", lambda: {"labels": [
+            {"id": "INBOX", "name": "INBOX"}, {"id": "Label_1", "name": "Facturas"}]})
+
+
+class _History:
+    def __init__(self, g):
+        self.g = g
+
+    def list(self, userId="me", startHistoryId=None, **kw):
+        # el buzón falso no cambia: nunca hay mensajes nuevos
+        return _Request(self.g, "history.list", lambda: {"historyId": str(self.g.history_id)})
+
+
+class _SendRequest:
+    """Subida reanudable: next_chunk() consume el media por bloques como la librería."""
+
+    def __init__(self, g, body, media):
+        self.g, self.body, self.media, self.pos = g, body, media, 0
+
+    def next_chunk(self, http=None, num_retries=0):
+        self.g._call("messages.send")
+        total = self.media.size()
+        chunk = self.media.getbytes(self.pos, self.media.chunksize())
+        self.pos += len(chunk)
+        if self.pos < total:
+            return MediaUploadProgress(self.pos, total), None
+        with self.g._lock:
+            self.g.sent.append(total)
+        return None, {"id": f"sent{len(self.g.sent)}", "labelIds": ["SENT"]}
+
+    def execute(self, http=None, num_retries=0):
+        response = None
+        while response is None:
+            _, response = self.next_chunk()
+        return response
+
+
+class _Batch:
+    """Batch: una sola latencia para todo el grupo; cada sub-petición puede fallar sola."""
+
+    def __init__(self, g, callback):
+        self.g, self.callback, self.requests = g, callback, []
+
+    def add(self, request, callback=None, request_id=None):
+        self.requests.append((request_id or str(len(self.requests)), request, callback or self.callback))
+
+    def execute(self, http=None):
+        with self.g._lock:
+            self.g.calls["batch"] = self.g.calls.get("batch", 0) + 1
+            roll = self.g._rnd.random()
+        if self.g.latency:
+            time.sleep(self.g.latency)
+        # falla el POST entero: como googleapiclient, HttpError antes de llamar a ningún callback
+        if roll < self.g.batch_error_rate / 2:
+            raise _http_error(429, "rateLimitExceeded", retry_after="0")
+        if roll < self.g.batch_error_rate:
+            raise _http_error(503, "backendError")
+        for request_id, request, cb in self.requests:
+            try:
+                response, exc = request._run(wait=False), None
+            except HttpError as e:
+                response, exc = None, e
+            cb(request_id, response, exc)
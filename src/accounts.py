@@ -0,0 +1,128 @@
+# src/accounts.py
+import os, threading, time
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from metrics import METRICS
+
+DEFAULT_CREDENTIALS = "config/credentials/credentials.json"
+DEFAULT_TOKEN = "config/credentials/token.pickle"
+# Totales del resumen que se suman entre cuentas
+SUMMED = ("messages", "total_pdfs", "saved", "skipped_processed", "skipped_hash", "skipped_dte",
+          "linked", "cache_hits", "cache_misses")
+
+
+def account_configs(cfg: dict, only=None) -> list:
+    """
+    Cuentas declaradas en config.yaml ("accounts"), cada una con su config ya mezclada:
+    lo que no define (keywords, label, ...) lo toma de la config general.
+    Sin "accounts", una sola cuenta "default" con las credenciales de siempre.
+    only: nombres a procesar (None = todas).
+    """
+    base = {k: v for k, v in cfg.items() if k != "accounts"}
+    declared = cfg.get("accounts") or []
+    if not declared:
+        return [{"name": "default", "credentials": DEFAULT_CREDENTIALS, "token": DEFAULT_TOKEN, "cfg": base}]
+
+    accounts = []
+    for acc in declared:
+        name = acc["name"]
+        if only and name not in only:
+            continue
+        folder = os.path.join("config", "credentials", name)
+        merged = {**base, **{k: v for k, v in acc.items() if k not in ("name", "credentials", "token")}}
+        merged["account"] = name
+        accounts.append({
+            "name": name,
+            "credentials": acc.get("credentials", os.path.join(folder, "credentials.json")),
+            "token": acc.get("token", os.path.join(folder, "token.pickle")),
+            "cfg": merged,
+        })
+    if only and not accounts:
+        raise SystemExit(f"Ninguna cuenta con esos nombres en config.yaml: {', '.join(only)}")
+    return accounts
+
+
+def _run_account(account, date_from, date_to, lot_dir, download, incremental, workers, events, resume=False):
+    """Corre en un proceso del pool: una cuenta completa. Los eventos vuelven por la cola."""
+    from gmail_client import get_gmail_service
+    from pipeline import run_pipeline
+
+    name = account["name"]
+    t0 = time.perf_counter()
+    gmail = get_gmail_service(account["credentials"], account["token"])
+    summary = run_pipeline(
+        gmail, account["cfg"], date_from, date_to,
+        lot_dir=lot_dir, download=download, incremental=incremental,
+        workers=workers or account["cfg"].get("workers", 4),
+        on_event=lambda ev: events.put({**ev, "account": name}),
+        export=False,
+        resume=resume,
+    )
+    summary["elapsed_s"] = round(time.perf_counter() - t0, 2)
+    summary["metrics"] = METRICS.dump()
+    return summary
+
+
+def run_accounts(cfg, date_from, date_to, lot_dir=None, download=False, incremental=False,
+                 workers=None, on_event=None, only=None, resume=False) -> dict:
+    """
+    Procesa varias cuentas a la vez, una por proceso (cada buzón tiene su propia cuota
+    en Gmail, así que no compiten), con max_parallel_accounts procesos como tope.
+    Comparten el estado de dedupe (SQLite), los blobs y el lote; el ledger y el CSV se
+    escriben una sola vez al final (y recién ahí se borran las bitácoras de cada cuenta,
+    ver journal.py). Devuelve el resumen total + "accounts" por cuenta.
+    """
+    from gmail_client import get_gmail_service
+    from pipeline import finalize_lot
+    import journal
+
+    emit = on_event or (lambda ev: None)
+    accounts = account_configs(cfg, only)
+
+    # El primer login abre el navegador: se hace acá, de a una cuenta, y no en el pool
+    for acc in accounts:
+        if not os.path.exists(acc["token"]):
+            emit({"event": "warning", "account": acc["name"], "text": "Sin token: se abre el login de Google"})
+            get_gmail_service(acc["credentials"], acc["token"])
+
+    ctx = mp.get_context("spawn")  # hilos + SQLite: mejor no heredar el proceso con fork
+    max_procs = min(len(accounts), cfg.get("max_parallel_accounts", os.cpu_count() or 1))
+    with ctx.Manager() as manager:
+        events = manager.Queue()
+        pump = threading.Thread(target=lambda: [emit(ev) for ev in iter(events.get, None)], daemon=True)
+        pump.start()
+        per_account, errors = {}, {}
+        try:
+            with ProcessPoolExecutor(max_workers=max_procs, mp_context=ctx) as pool:
+                futures = {
+                    pool.submit(_run_account, acc, date_from, date_to, lot_dir, download,
+                                incremental, workers, events, resume): acc["name"]
+                    for acc in accounts
+                }
+                for fut in as_completed(futures):
+                    name = futures[fut]
+                    try:
+                        per_account[name] = fut.result()
+                        METRICS.merge(per_account[name].pop("metrics"), account=name)
+                    except Exception as e:  # una cuenta caída no tumba las demás
+                        errors[name] = f"{type(e).__name__}: {e}"
+                        emit({"event": "warning", "account": name, "text": f"Falló la cuenta: {errors[name]}"})
+        finally:
+            events.put(None)
+            pump.join()
+
+    summary = {k: sum(s.get(k, 0) for s in per_account.values()) for k in SUMMED}
+    rows = [r for name in sorted(per_account) for r in per_account[name].pop("csv_rows")]
+    # los procesos de cada cuenta ya soltaron sus bitácoras: se toman hasta borrarlas
+    journals = journal.claim(p for s in per_account.values() for p in s.pop("journals", []))
+    summary["csv_rows"] = rows
+    try:
+        summary["csv_path"] = finalize_lot(cfg, lot_dir, rows) if download else None
+    except BaseException:
+        journal.release(journals)
+        raise
+    journal.remove(journals)
+    summary["accounts"] = {name: {k: v for k, v in s.items() if k != "csv_path"}
+                           for name, s in sorted(per_account.items())}
+    summary["errors"] = errors
+    return summary
@@ -0,0 +1,132 @@
+# src/blobs.py
+import os, errno, shutil, stat
+from metrics import METRICS
+
+# ioctl FICLONE de Linux (reflink en btrfs/xfs: copia instantánea, copy-on-write)
+FICLONE = 0x40049409
+# errores con los que un hardlink/reflink "no se puede" y toca otra estrategia
+_LINK_ERRNOS = {errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP, errno.EOPNOTSUPP,
+                errno.EINVAL, errno.ENOTTY, errno.EACCES}
+
+
+def _reflink(src: str, dst: str):
+    import fcntl
+    with open(src, "rb") as fs, open(dst, "xb") as fd:
+        try:
+            fcntl.ioctl(fd.fileno(), FICLONE, fs.fileno())
+        except OSError:
+            fd.close()
+            os.remove(dst)
+            raise
+
+
+class BlobStore:
+    """
+    Almacén por contenido: cada adjunto se guarda una sola vez en
+    <root>/ab/cd/<sha256> (solo lectura). Los archivos de los lotes son hardlinks
+    al blob; si el sistema de archivos no deja, reflink y, si tampoco, copia.
+    Así, lotes que se solapan (mes, trimestre, año) no duplican disco ni escrituras.
+    """
+
+    def __init__(self, root: str = "data/blobs"):
+        self.root = root
+
+    def path(self, sha256: str) -> str:
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def has(self, sha256: str) -> bool:
+        return os.path.exists(self.path(sha256))
+
+    def put_temp(self, tmp_path: str, sha256: str) -> str:
+        """Mueve un temporal (ya con su hash) al almacén; si el blob ya existía, descarta el temporal."""
+        path = self.path(sha256)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+            METRICS.inc("blob_puts_total", result="existing")
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.link(tmp_path, path)  # exclusivo: si otro proceso lo guardó recién, no se pisa
+            os.remove(tmp_path)
+        except FileExistsError:
+            os.remove(tmp_path)
+            METRICS.inc("blob_puts_total", result="existing")
+            return path
+        except OSError as e:
+            if e.errno not in _LINK_ERRNOS:
+                raise
+            shutil.move(tmp_path, path)  # temporal en otro disco o sin hardlinks
+        os.chmod(path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)  # un hardlink editado no debe tocar el blob
+        METRICS.inc("blob_puts_total", result="new")
+        return path
+
+    def link(self, sha256: str, dest: str) -> str:
+        """Crea dest apuntando al blob: hardlink, reflink o copia (en ese orden). Devuelve el modo usado."""
+        src = self.path(sha256)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        mode = "copy"
+        try:
+            os.link(src, dest)
+            mode = "hardlink"
+        except OSError as e:
+            if e.errno not in _LINK_ERRNOS:
+                raise
+            try:
+                _reflink(src, dest)
+                mode = "reflink"
+            except FileExistsError:
+                raise
+            except (OSError, ImportError):
+                with open(src, "rb") as fs, open(dest, "xb") as fd:  # "x": no pisar un archivo ajeno
+                    shutil.copyfileobj(fs, fd)
+        METRICS.inc("blob_links_total", mode=mode)
+        return mode
+
+    def iter_blobs(self):
+        for root, _, files in os.walk(self.root):
+            for name in files:
+                if len(name) == 64:
+                    yield name, os.path.join(root, name)
+
+    def gc(self, referenced_copies=None, dry_run: bool = False) -> dict:
+        """
+        Borra blobs que ningún lote usa. Un blob está en uso si tiene otro hardlink
+        (st_nlink > 1) o si referenced_copies(sha256) dice que hay una copia/reflink
+        suya en algún lote (esos no suben st_nlink).
+        """
+        removed, freed, kept = 0, 0, 0
+        for sha256, path in self.iter_blobs():
+            st = os.stat(path)
+            if st.st_nlink > 1 or (referenced_copies and referenced_copies(sha256)):
+                kept += 1
+                continue
+            removed += 1
+            freed += st.st_size
+            if not dry_run:
+                os.remove(path)
+        if not dry_run:
+            for root, dirs, files in os.walk(self.root, topdown=False):
+                if root != self.root and not dirs and not files:
+                    os.rmdir(root)
+        return {"removed": removed, "freed_bytes": freed, "kept": kept}
+
+
+if __name__ == "__main__":
+    # Limpieza de blobs sin referencias: python src/blobs.py gc [--dry-run]
+    import argparse
+    from state import open_state
+    ap = argparse.ArgumentParser(description="Almacén de adjuntos por contenido (SHA-256).")
+    ap.add_argument("command", choices=["gc"])
+    ap.add_argument("--dry-run", action="store_true", help="Solo mostrar qué se borraría")
+    ap.add_argument("--output-dir", default="data")
+    args = ap.parse_args()
+
+    store = BlobStore(os.path.join(args.output_dir, "blobs"))
+    state = open_state(os.path.join(args.output_dir, "state"), args.output_dir)
+    try:
+        res = store.gc(lambda sha: any(os.path.exists(r["path"]) for r in state.lots_for_hash(sha)),
+                       dry_run=args.dry_run)
+    finally:
+        state.close()
+    verb = "Se borrarían" if args.dry_run else "Borrados"
+    print(f"{verb} {res['removed']} blobs ({res['freed_bytes'] / (1024 * 1024):.1f} MB); en uso: {res['kept']}")
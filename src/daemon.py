@@ -0,0 +1,171 @@
+# src/daemon.py
+import json, os, signal, socket, socketserver, threading
+from datetime import date
+
+SOCKET_PATH = "data/state/dte.sock"
+
+
+# -------------------------
+# Cliente (lo usa main.py --submit): solo socket + json, arranca al toque
+# -------------------------
+def request(payload: dict, path: str = SOCKET_PATH, timeout: float = 10.0) -> dict:
+    """Manda un pedido al daemon y devuelve su respuesta (RuntimeError si el daemon dice que no)."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        try:
+            s.connect(path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            raise RuntimeError(f"No hay daemon escuchando en {path} (arrancarlo con: python src/daemon.py serve)")
+        s.sendall((json.dumps(payload) + "\n").encode("utf-8"))
+        reply = json.loads(s.makefile("rb").readline() or b"{}")
+    if not reply.get("ok"):
+        raise RuntimeError(reply.get("error", "respuesta vacía del daemon"))
+    return reply
+
+
+def _alive(path: str) -> bool:
+    try:
+        request({"cmd": "ping"}, path, timeout=2)
+        return True
+    except (RuntimeError, OSError):
+        return False
+
+
+# -------------------------
+# Servidor
+# -------------------------
+class _Handler(socketserver.StreamRequestHandler):
+    # una línea JSON de pedido, una línea JSON de respuesta
+    def handle(self):
+        try:
+            reply = self.server.dispatch(json.loads(self.rfile.readline()))
+        except Exception as e:
+            reply = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+        self.wfile.write((json.dumps(reply, ensure_ascii=False, default=str) + "\n").encode("utf-8"))
+
+
+class Daemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Atiende pedidos por un socket Unix local y los pasa al JobRunner (jobs.py): los jobs
+    quedan en cola y corren en este proceso, con el servicio de Gmail, el estado de
+    dedupe, el caché de mensajes y el SCHEDULER (cuota) compartidos y ya calientes.
+    """
+    daemon_threads = True
+
+    def __init__(self, path: str, runner, cfg: dict):
+        self.runner = runner
+        self.cfg = cfg
+        super().__init__(path, _Handler)
+
+    def dispatch(self, req: dict) -> dict:
+        cmd = req.get("cmd")
+        if cmd == "ping":
+            return {"ok": True, "pid": os.getpid()}
+        if cmd == "submit":
+            return {"ok": True, "job": self.runner.submit(self._params(req["params"])).snapshot()}
+        if cmd == "get":
+            job = self.runner.get(req["id"])
+            return {"ok": True, "job": job} if job else {"ok": False, "error": f"No existe el job {req['id']}"}
+        if cmd == "jobs":
+            return {"ok": True, "jobs": self.runner.jobs()}
+        if cmd == "cancel":
+            self.runner.cancel(req["id"])
+            return {"ok": True}
+        if cmd == "stop":
+            threading.Thread(target=self.shutdown, daemon=True).start()
+            return {"ok": True}
+        return {"ok": False, "error": f"Comando desconocido: {cmd}"}
+
+    def _params(self, p: dict) -> dict:
+        # se valida al recibir: un job mal armado falla acá y no en la cola
+        if date.fromisoformat(p["date_from"]) > date.fromisoformat(p["date_to"]):
+            raise ValueError("El rango termina antes de empezar")
+        if p.get("send") and not p.get("to_email"):
+            p["to_email"] = os.getenv("CONTADORA_EMAIL") or self.cfg.get("contadora_email")
+            if not p["to_email"]:
+                raise ValueError("Falta CONTADORA_EMAIL en .env o 'contadora_email' en config.yaml")
+        return p
+
+
+def serve(cfg: dict, path: str, logger):
+    from gmail_client import get_gmail_service
+    from jobs import JobRunner
+    from metrics import METRICS
+    from msg_cache import MessageCache
+    from state import open_state
+    from logging_conf import run_artifact
+    import ledger  # noqa: F401  (pyarrow: se paga una vez al arrancar, no en cada job)
+
+    if cfg.get("accounts"):
+        raise SystemExit("El daemon atiende una sola cuenta: para varias, usar main.py sin --submit")
+    if os.path.exists(path):
+        if _alive(path):
+            raise SystemExit(f"Ya hay un daemon escuchando en {path}")
+        os.remove(path)  # quedó de un daemon que se cayó
+
+    get_gmail_service()  # login / refresh del token ahora y no en el primer job
+    state = open_state("data/state", cfg.get("output_dir", "data"))
+    cache = MessageCache(max_bytes=cfg.get("message_cache_mb", 200) * 1024 * 1024)
+
+    def on_finish(job):
+        s = job.summary or {}
+        logger.info(
+            f"Job {job.id} {job.params['date_from']}→{job.params['date_to']}: {job.status} "
+            f"({job.finished - job.started:.1f}s, {s.get('messages', 0)} mensajes, {s.get('saved', 0)} guardados)"
+            + (f" — {job.error}" if job.error else "")
+        )
+        METRICS.write(run_artifact(), {"daemon_pid": os.getpid()})  # acumuladas desde que arrancó
+
+    runner = JobRunner(get_gmail_service, cfg, max_jobs=cfg.get("daemon_max_jobs", 2),
+                       shared={"state": state, "cache": cache}, on_finish=on_finish)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    old_umask = os.umask(0o077)  # el socket solo para este usuario
+    try:
+        server = Daemon(path, runner, cfg)
+    finally:
+        os.umask(old_umask)
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown, daemon=True).start())
+    logger.info(f"Daemon escuchando en {path} (pid {os.getpid()})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logger.info("Deteniendo daemon: se cancelan los jobs pendientes")
+        server.server_close()
+        runner.shutdown()
+        if os.path.exists(path):
+            os.remove(path)
+        cache.close()
+        state.close()
+
+
+if __name__ == "__main__":
+    # python src/daemon.py serve
+    # python src/daemon.py jobs | cancel <id> | stop
+    import argparse, yaml
+    from dotenv import load_dotenv
+    ap = argparse.ArgumentParser(description="Daemon de DTE Bot: recibe corridas (main.py --submit) y las encola.")
+    ap.add_argument("command", choices=["serve", "jobs", "cancel", "stop"])
+    ap.add_argument("job_id", nargs="?")
+    args = ap.parse_args()
+
+    load_dotenv()
+    with open("config/config.yaml", "r", encoding="utf-8") as f:
+        cfg = yaml.safe_load(f)
+    path = cfg.get("daemon_socket", SOCKET_PATH)
+
+    if args.command == "serve":
+        from logging_conf import setup_logging
+        serve(cfg, path, setup_logging())
+    elif args.command == "jobs":
+        for job in request({"cmd": "jobs"}, path)["jobs"]:
+            p = job["params"]
+            print(f"{job['id']}  {p['date_from']}→{p['date_to']}  {job['status']:<9}  {job['stage']:<12}  "
+                  f"{job['progress']:.0%}  {job['elapsed_s']}s")
+    elif args.command == "cancel":
+        if not args.job_id:
+            ap.error("cancel necesita el id del job")
+        request({"cmd": "cancel", "id": args.job_id}, path)
+    else:
+        request({"cmd": "stop"}, path)
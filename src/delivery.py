@@ -0,0 +1,48 @@
+# src/delivery.py
+import os
+from metrics import METRICS
+from state import open_state
+from storage import make_zip, make_delta_zips, zip_contents
+
+# Gmail rechaza correos de más de 25 MB y el adjunto viaja en base64 (~1.37x)
+DEFAULT_MAX_ZIP_MB = 18
+
+
+def send_lot(gmail, cfg, lot_dir, to_email, subject, body, delta=False, zip_path=None,
+             progress=None, on_part=None, state=None) -> list:
+    """
+    Envía el lote a to_email y anota en el estado qué archivos le llegaron (tabla deliveries).
+      - delta=False: el ZIP completo del lote (zip_path si ya está hecho).
+      - delta=True: solo lo que esa dirección todavía no recibió de este lote, en uno o
+        más ZIP de hasta max_zip_mb; cada parte es un correo aparte con su reporte_delta.csv.
+    Cada parte se anota recién cuando su correo salió: si una falla, la siguiente corrida
+    manda desde ahí. on_part(k, n, part) se llama antes de enviar cada parte.
+    Devuelve las partes enviadas [{path, files, bytes}] (vacía si no había nada nuevo).
+    """
+    from mailer import send_mail_with_attachment
+
+    own_state = state is None
+    if own_state:
+        state = open_state("data/state", cfg.get("output_dir", "data"))
+    lot, recipient = os.path.basename(lot_dir), to_email.strip().lower()
+    try:
+        if delta:
+            max_bytes = int(cfg.get("max_zip_mb", DEFAULT_MAX_ZIP_MB) * 1024 * 1024)
+            with METRICS.stage("zip"):
+                parts = make_delta_zips(lot_dir, state.delivered(lot, recipient), max_bytes)
+        else:
+            zip_path = zip_path or make_zip(lot_dir)
+            parts = [{"path": zip_path, "files": zip_contents(zip_path), "bytes": os.path.getsize(zip_path)}]
+
+        for k, part in enumerate(parts, 1):
+            if on_part:
+                on_part(k, len(parts), part)
+            part_subject = f"{subject} (parte {k} de {len(parts)})" if len(parts) > 1 else subject
+            send_mail_with_attachment(gmail, to_email, part_subject, body, part["path"], progress=progress)
+            state.record_delivery(lot, recipient, part["files"])
+            METRICS.inc("deliveries_total", mode="delta" if delta else "full")
+            METRICS.inc("delivered_files_total", len(part["files"]), mode="delta" if delta else "full")
+    finally:
+        if own_state:
+            state.close()
+    return parts
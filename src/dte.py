@@ -0,0 +1,76 @@
+# src/dte.py
+import json
+
+# Contenedores en los que a veces viene el DTE (p. ej. el JSON que devuelve el portal)
+_WRAPPERS = ("dteJson", "documento", "dte", "json")
+
+
+def _find_doc(obj):
+    if isinstance(obj, dict):
+        if isinstance(obj.get("identificacion"), dict):
+            return obj
+        for k in _WRAPPERS:
+            inner = obj.get(k)
+            if isinstance(inner, str):
+                try:
+                    inner = json.loads(inner)
+                except ValueError:
+                    continue
+            if isinstance(inner, dict) and isinstance(inner.get("identificacion"), dict):
+                return inner
+    return None
+
+
+def _num(value):
+    try:
+        return round(float(value), 2)
+    except (TypeError, ValueError):
+        return None
+
+
+def _iva(resumen: dict):
+    """totalIva (facturas) o el tributo 20 = IVA 13% (créditos fiscales)."""
+    if resumen.get("totalIva") is not None:
+        return _num(resumen["totalIva"])
+    valores = [_num(t.get("valor")) for t in resumen.get("tributos") or [] if str(t.get("codigo")) == "20"]
+    valores = [v for v in valores if v is not None]
+    return round(sum(valores), 2) if valores else None
+
+
+def parse_dte(data: bytes):
+    """
+    Lee el JSON de un DTE y devuelve sus datos:
+      {codigo_generacion, numero_control, emisor_nit, tipo_dte, fec_emi,
+       emisor_nombre, receptor_nit, receptor_nombre,
+       total_gravada, total_exenta, total_no_suj, total_iva, total_pagar}
+    o None si no es un DTE (no es JSON o no trae identificacion.codigoGeneracion).
+    """
+    try:
+        doc = _find_doc(json.loads(data.decode("utf-8-sig")))
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if doc is None:
+        return None
+    ident = doc["identificacion"]
+    codigo = str(ident.get("codigoGeneracion") or "").strip().upper()
+    if not codigo:
+        return None
+    emisor = doc.get("emisor") or {}
+    receptor = doc.get("receptor") or {}
+    resumen = doc.get("resumen") or {}
+    return {
+        "codigo_generacion": codigo,
+        "numero_control": str(ident.get("numeroControl") or "").strip().upper(),
+        "emisor_nit": str(emisor.get("nit") or "").replace("-", "").strip(),
+        "tipo_dte": ident.get("tipoDte"),
+        "fec_emi": ident.get("fecEmi"),
+        "emisor_nombre": emisor.get("nombre") or emisor.get("nombreComercial"),
+        # consumidor final: a veces no hay NIT, solo numDocumento
+        "receptor_nit": str(receptor.get("nit") or receptor.get("numDocumento") or "").replace("-", "").strip(),
+        "receptor_nombre": receptor.get("nombre"),
+        "total_gravada": _num(resumen.get("totalGravada")),
+        "total_exenta": _num(resumen.get("totalExenta")),
+        "total_no_suj": _num(resumen.get("totalNoSuj")),
+        "total_iva": _iva(resumen),
+        "total_pagar": _num(resumen.get("totalPagar", resumen.get("montoTotalOperacion"))),
+    }
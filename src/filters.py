@@ -1,4 +1,5 @@
 from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
 
 def build_gmail_query(keywords, date_from, date_to, label=None):
     def fmt(d: datetime) -> str:
@@ -14,3 +15,44 @@ def build_gmail_query(keywords, date_from, date_to, label=None):
     lab = f' label:\"{label}\"' if label else ""
 
     return (subject + attach + date_part + lab).strip()
+
+
+def split_date_range(date_from, date_to, shard="day"):
+    """
+    Parte el rango [date_from, date_to] en tramos por día ("day") o por semana
+    ("week"). Devuelve [(desde, hasta), ...] en ISO (ambos inclusive), del más viejo
+    al más nuevo. Con shard vacío devuelve el rango completo como un solo tramo.
+    """
+    df = datetime.fromisoformat(date_from).date()
+    dt = datetime.fromisoformat(date_to).date()
+    if not shard:
+        return [(df.isoformat(), dt.isoformat())]
+    step = timedelta(days=7 if shard == "week" else 1)
+    shards = []
+    cur = df
+    while cur <= dt:
+        end = min(cur + step - timedelta(days=1), dt)
+        shards.append((cur.isoformat(), end.isoformat()))
+        cur = end + timedelta(days=1)
+    return shards
+
+
+def message_matches(message, keywords, date_from, date_to, label_id=None, timezone=None):
+    """
+    Aplica localmente los mismos criterios de build_gmail_query a un mensaje
+    (perfil "metadata"): keyword en el asunto, fecha dentro del rango y etiqueta.
+    El filtro de adjuntos se resuelve después, al buscar PDFs/JSON en las partes.
+    """
+    headers = {h["name"].lower(): h["value"] for h in message.get("payload", {}).get("headers", [])}
+    subject = headers.get("subject", "").casefold()
+    if not any(k.casefold() in subject for k in keywords):
+        return False
+
+    if label_id and label_id not in (message.get("labelIds") or []):
+        return False
+
+    tz = ZoneInfo(timezone) if timezone else None
+    received = datetime.fromtimestamp(int(message.get("internalDate", 0)) / 1000.0, tz)
+    df = datetime.fromisoformat(date_from).date()
+    dt = datetime.fromisoformat(date_to).date()
+    return df <= received.date() <= dt
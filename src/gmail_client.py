@@ -1,53 +1,107 @@
-import os, pickle, base64
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
+import os, json, pickle, base64, threading, time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from googleapiclient.errors import HttpError
+from metrics import METRICS
+from scheduler import SCHEDULER, QUOTA_UNITS, is_throttle, should_retry, retry_after
 
 
 SCOPES = [
     "https://www.googleapis.com/auth/gmail.readonly",
     "https://www.googleapis.com/auth/gmail.send",
 ]
+# Copia local del discovery document de Gmail (si la librería no trae la suya)
+DISCOVERY_CACHE = "data/state/gmail.v1.discovery.json"
+DISCOVERY_URL = "https://gmail.googleapis.com/$discovery/rest?version=v1"
 
+# Servicios ya armados en este proceso, por token: se reusan entre corridas (UI, daemon)
+_SERVICES = {}
+_SERVICES_LOCK = threading.Lock()
 
-def get_gmail_service(
-    creds_path="config/credentials/credentials.json",
-    token_path="config/credentials/token.pickle",
-):
+
+def _load_credentials(creds_path, token_path):
     creds = None
     if os.path.exists(token_path):
         with open(token_path, "rb") as f:
             creds = pickle.load(f)
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
+            from google.auth.transport.requests import Request
             creds.refresh(Request())
         else:
+            # solo el primer login necesita oauthlib (y abre el navegador)
+            from google_auth_oauthlib.flow import InstalledAppFlow
             flow = InstalledAppFlow.from_client_secrets_file(creds_path, SCOPES)
             creds = flow.run_local_server(port=0)
 
         os.makedirs(os.path.dirname(token_path), exist_ok=True)
         with open(token_path, "wb") as f:
             pickle.dump(creds, f)
+    return creds
+
+
+def discovery_document() -> str:
+    """
+    Discovery document de Gmail v1 sin pedirlo a la red en cada arranque:
+    la copia que trae google-api-python-client (>= 2.0) o, si no, la de
+    DISCOVERY_CACHE, que se descarga una sola vez.
+    """
+    try:
+        from googleapiclient.discovery_cache import get_static_doc
+        doc = get_static_doc("gmail", "v1")
+    except ImportError:
+        doc = None
+    if doc:
+        return doc
+    if os.path.exists(DISCOVERY_CACHE):
+        with open(DISCOVERY_CACHE, "r", encoding="utf-8") as f:
+            return f.read()
+    import httplib2
+    resp, content = httplib2.Http(timeout=30).request(DISCOVERY_URL)
+    if resp.status != 200:
+        raise RuntimeError(f"No se pudo bajar el discovery document de Gmail (HTTP {resp.status})")
+    doc = content.decode("utf-8")
+    json.loads(doc)  # no guardar basura si la respuesta no es JSON
+    os.makedirs(os.path.dirname(DISCOVERY_CACHE), exist_ok=True)
+    tmp = DISCOVERY_CACHE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(doc)
+    os.replace(tmp, DISCOVERY_CACHE)
+    return doc
+
 
-    return build("gmail", "v1", credentials=creds)
+def get_gmail_service(
+    creds_path="config/credentials/credentials.json",
+    token_path="config/credentials/token.pickle",
+):
+    """
+    Servicio de Gmail listo para usar. Se arma una vez por token y proceso y después
+    se reusa (las credenciales se refrescan solas cuando vencen).
+    """
+    key = os.path.abspath(token_path)
+    with _SERVICES_LOCK:
+        gmail = _SERVICES.get(key)
+        if gmail is None:
+            from googleapiclient.discovery import build_from_document
+            creds = _load_credentials(creds_path, token_path)
+            gmail = _SERVICES[key] = build_from_document(discovery_document(), credentials=creds)
+    return gmail
+
+
+SEARCH_PAGE_MAX = 500  # máximo que acepta messages.list por página
 
 
-def search_messages(gmail, query, max_results=100):
-    res = (
-        gmail.users()
-        .messages()
-        .list(userId="me", q=query, maxResults=max_results)
-        .execute()
+def search_messages(gmail, query, max_results=100, http=None):
+    res = SCHEDULER.execute(
+        gmail.users().messages().list(userId="me", q=query, maxResults=max_results),
+        "messages.list", http=http,
     )
     messages = res.get("messages", [])
     next_token = res.get("nextPageToken")
 
     while next_token:
-        res = (
-            gmail.users()
-            .messages()
-            .list(userId="me", q=query, maxResults=max_results, pageToken=next_token)
-            .execute()
+        res = SCHEDULER.execute(
+            gmail.users().messages().list(userId="me", q=query, maxResults=max_results, pageToken=next_token),
+            "messages.list", http=http,
         )
         messages.extend(res.get("messages", []))
         next_token = res.get("nextPageToken")
@@ -55,8 +109,161 @@ def search_messages(gmail, query, max_results=100):
     return [m["id"] for m in messages]
 
 
-def get_message(gmail, msg_id):
-    return gmail.users().messages().get(userId="me", id=msg_id, format="full").execute()
+# --- Sincronización incremental (history API) ---
+def get_history_id(gmail, http=None):
+    """historyId actual del buzón."""
+    return SCHEDULER.execute(gmail.users().getProfile(userId="me"), "getProfile", http=http)["historyId"]
+
+
+def get_label_id(gmail, label_name, http=None):
+    """Traduce el nombre de una etiqueta de Gmail a su id (None si no existe)."""
+    if not label_name:
+        return None
+    res = SCHEDULER.execute(gmail.users().labels().list(userId="me"), "labels.list", http=http)
+    for lab in res.get("labels", []):
+        if lab.get("name") == label_name:
+            return lab["id"]
+    return None
+
+
+def list_history_added(gmail, start_history_id, label_id=None, http=None):
+    """
+    Ids de mensajes agregados desde start_history_id y el historyId más reciente.
+    Si el historyId ya expiró, Gmail responde 404 (HttpError): el llamador debe
+    volver a un listado completo.
+    http: transporte a usar (p. ej. thread_http(gmail) si se llama desde otro hilo).
+    """
+    ids = []
+    page = None
+    while True:
+        res = SCHEDULER.execute(
+            gmail.users().history().list(
+                userId="me",
+                startHistoryId=start_history_id,
+                historyTypes=["messageAdded"],
+                labelId=label_id,
+                maxResults=500,
+                pageToken=page,
+            ),
+            "history.list", http=http,
+        )
+        for h in res.get("history", []):
+            for added in h.get("messagesAdded", []):
+                ids.append(added["message"]["id"])
+        page = res.get("nextPageToken")
+        if not page:
+            break
+    return list(dict.fromkeys(ids)), res.get("historyId", start_history_id)
+
+
+# --- Perfiles de lectura de mensajes ---
+def _parts_mask(depth):
+    """Máscara fields= para el árbol MIME: solo lo que usamos de cada parte."""
+    mask = "partId,mimeType,filename,body(attachmentId,size)"
+    if depth:
+        mask += f",parts({_parts_mask(depth - 1)})"
+    return mask
+
+
+# El pipeline solo usa Subject/From, internalDate y nombres/attachmentId de las partes.
+# Con fields= Gmail no manda el cuerpo inline (body.data) ni el resto de metadatos.
+LEAN_FIELDS = f"id,internalDate,payload(headers(name,value),{_parts_mask(5)})"
+
+FETCH_PROFILES = {
+    # respuesta completa (incluye cuerpos inline)
+    "full": {"format": "full"},
+    # lo justo para contar PDFs, nombrar carpetas/archivos y ubicar adjuntos
+    "lean": {"format": "full", "fields": LEAN_FIELDS},
+    # solo encabezados: Gmail no devuelve partes en este formato (no sirve para contar PDFs)
+    "metadata": {
+        "format": "metadata",
+        "metadataHeaders": ["Subject", "From"],
+        "fields": "id,internalDate,labelIds,payload/headers",
+    },
+}
+
+
+def _get_request(gmail, msg_id, profile):
+    return gmail.users().messages().get(userId="me", id=msg_id, **FETCH_PROFILES[profile])
+
+
+def get_message(gmail, msg_id, profile="lean", http=None):
+    return SCHEDULER.execute(_get_request(gmail, msg_id, profile), "messages.get", http=http)
+
+
+def get_messages_batch(gmail, ids, chunk=50, max_retries=3, profile="lean", cache=None, http=None):
+    """
+    Trae mensajes en grupos usando el endpoint batch de Gmail (máx. 100 por batch,
+    Google recomienda <= 50). Devuelve un iterador en el mismo orden de ids.
+    profile: clave de FETCH_PROFILES ("lean" por defecto).
+    Cada sub-petición consume su cuota en el SCHEDULER. Si algunas fallan, reintenta
+    solo esas (backoff con jitter, respetando Retry-After y bajando la tasa si fue 429);
+    si falla el batch entero (429/5xx), se reenvía igual. Las que siguen fallando se piden una por una para que el error real se propague.
+    cache: MessageCache opcional; solo se piden a la API los ids que no estén ahí.
+    http: transporte a usar (p. ej. thread_http(gmail) si se llama desde otro hilo).
+    """
+    ids = list(ids)
+    for start in range(0, len(ids), chunk):
+        group = ids[start:start + chunk]
+        found = cache.get_many(group, profile) if cache is not None else {}
+        pending = [mid for mid in group if mid not in found]
+        fetched = list(pending)
+        for attempt in range(max_retries + 1):
+            if not pending:
+                break
+            failed, errors = [], []
+
+            def _collect(request_id, response, exception):
+                if exception is not None:
+                    failed.append(request_id)
+                    errors.append(exception)
+                else:
+                    found[request_id] = response
+
+            batch = gmail.new_batch_http_request(callback=_collect)
+            for mid in pending:
+                batch.add(_get_request(gmail, mid, profile), request_id=mid)
+            SCHEDULER.acquire(QUOTA_UNITS["messages.get"] * len(pending))
+            METRICS.inc("gmail_api_calls_total", endpoint="batch")
+            METRICS.inc("gmail_api_calls_total", len(pending), endpoint="messages.get")
+            t0 = time.perf_counter()
+            try:
+                batch.execute(http=http)
+            except HttpError as e:
+                # falló el batch entero (429/5xx del POST a /batch): se reenvían todos los pendientes
+                METRICS.observe("gmail_api_latency_seconds", time.perf_counter() - t0, endpoint="batch")
+                if not should_retry(e):
+                    raise
+                if is_throttle(e):
+                    SCHEDULER.on_throttle()
+                pending = [mid for mid in pending if mid not in found]
+                if attempt == max_retries:
+                    break
+                METRICS.inc("gmail_api_retries_total", endpoint="batch")
+                SCHEDULER.backoff(attempt, retry_after(e))
+                continue
+            # latencia del batch completo (las sub-peticiones no se pueden medir por separado)
+            METRICS.observe("gmail_api_latency_seconds", time.perf_counter() - t0, endpoint="batch")
+
+            pending = failed
+            throttled = [e for e in errors if isinstance(e, HttpError) and is_throttle(e)]
+            if throttled:
+                SCHEDULER.on_throttle()
+            elif not pending:
+                SCHEDULER.on_success()
+            if not pending or attempt == max_retries:
+                break
+            hints = [h for h in (retry_after(e) for e in throttled) if h is not None]
+            SCHEDULER.backoff(attempt, max(hints) if hints else None)
+
+        for mid in pending:
+            found[mid] = get_message(gmail, mid, profile, http=http)
+
+        if cache is not None and fetched:
+            cache.put_many([found[mid] for mid in fetched], profile)
+
+        for mid in group:
+            yield found.pop(mid)
 
 
 def count_pdf_attachments(message):
@@ -113,11 +320,10 @@ def download_pdf_attachments(gmail, message):
             # a veces el PDF viene inline sin attachmentId; lo ignoramos por simplicidad
             continue
 
-        att = gmail.users().messages().attachments().get(
-            userId="me",
-            messageId=message["id"],
-            id=att_id
-        ).execute()
+        att = SCHEDULER.execute(
+            gmail.users().messages().attachments().get(userId="me", messageId=message["id"], id=att_id),
+            "attachments.get",
+        )
 
         # Gmail retorna base64-url-safe
         file_bytes = base64.urlsafe_b64decode(att["data"].encode("utf-8"))
@@ -129,13 +335,15 @@ def download_pdf_attachments(gmail, message):
 
     return results
 
-# -- NUEVO: descarga adjuntos con extensiones específicas --
-def download_attachments(gmail, message, exts=("pdf", "json")):
+
+# --- Adjuntos: descriptores perezosos ---
+def iter_attachments(message, exts=("pdf", "json")):
     """
-    Devuelve lista de adjuntos cuyas extensiones estén en exts.
-    [{filename, attachment_id, data}]
+    Recorre las partes del mensaje y devuelve descriptores de los adjuntos cuyas
+    extensiones estén en exts, SIN descargar nada:
+      {message_id, attachment_id, filename, size, part_id, mime_type}
+    Los bytes se piden después, solo para los que hagan falta (fetch_attachment).
     """
-    results = []
     payload = message.get("payload", {}) or {}
     for part in _iter_parts(payload):
         fname = (part.get("filename") or "").strip()
@@ -147,9 +355,82 @@ def download_attachments(gmail, message, exts=("pdf", "json")):
         att_id = body.get("attachmentId")
         if not att_id:
             continue
-        att = gmail.users().messages().attachments().get(
-            userId="me", messageId=message["id"], id=att_id
-        ).execute()
-        file_bytes = base64.urlsafe_b64decode(att["data"].encode("utf-8"))
-        results.append({"filename": fname, "attachment_id": att_id, "data": file_bytes})
+        yield {
+            "message_id": message["id"],
+            "attachment_id": att_id,
+            "filename": fname,
+            "size": int(body.get("size", 0) or 0),
+            "part_id": part.get("partId"),
+            "mime_type": part.get("mimeType"),
+        }
+
+
+def fetch_attachment_b64(gmail, message_id, attachment_id, http=None):
+    """Descarga un adjunto y devuelve el texto base64-url-safe tal como lo manda Gmail."""
+    att = SCHEDULER.execute(
+        gmail.users().messages().attachments().get(userId="me", messageId=message_id, id=attachment_id),
+        "attachments.get", http=http,
+    )
+    METRICS.inc("bytes_downloaded_total", len(att["data"]))
+    return att["data"]
+
+
+def fetch_attachment(gmail, message_id, attachment_id, http=None):
+    """Descarga un adjunto y devuelve sus bytes."""
+    data = fetch_attachment_b64(gmail, message_id, attachment_id, http=http)
+    return base64.urlsafe_b64decode(data.encode("utf-8"))
+
+
+# -- NUEVO: descarga adjuntos con extensiones específicas --
+def download_attachments(gmail, message, exts=("pdf", "json")):
+    """
+    Devuelve lista de adjuntos cuyas extensiones estén en exts.
+    [{filename, attachment_id, data}]
+    """
+    results = []
+    for item in iter_attachments(message, exts):
+        file_bytes = fetch_attachment(gmail, item["message_id"], item["attachment_id"])
+        results.append({"filename": item["filename"], "attachment_id": item["attachment_id"], "data": file_bytes})
     return results
+
+
+# --- Descarga concurrente ---
+_thread_local = threading.local()
+
+
+def thread_http(gmail):
+    """
+    httplib2 no es thread-safe: cada hilo del pool usa su propio transporte
+    autorizado con las mismas credenciales del servicio.
+    """
+    cache = getattr(_thread_local, "http", None)
+    if cache is None:
+        cache = _thread_local.http = {}
+    creds = gmail._http.credentials
+    http = cache.get(id(creds))
+    if http is None:
+        import httplib2
+        from google_auth_httplib2 import AuthorizedHttp
+        http = cache[id(creds)] = AuthorizedHttp(creds, http=httplib2.Http())
+    return http
+
+
+def download_attachments_concurrent(gmail, items, workers=4, sink=None):
+    """
+    Descarga adjuntos de muchos mensajes a la vez en un pool de hilos.
+    items: descriptores de iter_attachments (o dicts con message_id y attachment_id).
+    Sin sink, cada uno se devuelve con "data" (bytes) agregado. Con sink, el worker
+    llama sink(item, b64) y se devuelve el item con el dict que retorne sink
+    (p. ej. storage.stream_b64_to_temp: el archivo va directo a disco).
+    Los resultados salen en el orden en que terminan.
+    """
+    def _work(item):
+        b64 = fetch_attachment_b64(gmail, item["message_id"], item["attachment_id"], http=thread_http(gmail))
+        if sink is not None:
+            return {**item, **sink(item, b64)}
+        return {**item, "data": base64.urlsafe_b64decode(b64.encode("utf-8"))}
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [pool.submit(_work, it) for it in items]
+        for fut in as_completed(futures):
+            yield fut.result()
@@ -0,0 +1,247 @@
+# src/jobs.py
+import threading, time, uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pipeline import run_pipeline
+from storage import DELTA_CSV, ensure_lot_dir, make_zip
+
+# mailer sube con el transporte del servicio compartido (httplib2 no es thread-safe):
+# con varios jobs, un envío a la vez
+_SEND_LOCK = threading.Lock()
+
+
+class Job:
+    """
+    Una corrida (rango de fechas + descargar/ZIP/enviar) que corre en segundo plano.
+    El pipeline le manda sus eventos y el job lleva el progreso; la UI solo lee
+    snapshot(), que es un dict armado bajo lock.
+    """
+
+    def __init__(self, params: dict):
+        self.id = uuid.uuid4().hex[:8]
+        self.params = params
+        self.cancel = threading.Event()
+        self._lock = threading.Lock()
+        self.status = "queued"   # queued | running | done | failed | cancelled
+        self.stage = "en cola"
+        self.created = time.time()
+        self.started = self.finished = None
+        self.messages_total = self.messages_done = 0
+        self.files_seen = self.files_done = 0
+        self.bytes_saved = 0
+        self.upload = None       # (enviados, total) al subir el ZIP
+        self.log = deque(maxlen=50)
+        self.summary = None
+        self.zip_path = None
+        self.sent_parts = None   # correos enviados (con delta puede ser 0 o varios)
+        self.error = None
+        self.after = []          # jobs del mismo rango que tienen que terminar antes
+        self.finished_event = threading.Event()
+
+    def set_stage(self, stage: str):
+        with self._lock:
+            self.stage = stage
+            self.log.append(f"— {stage}")
+
+    def on_event(self, ev: dict):
+        kind = ev["event"]
+        with self._lock:
+            if kind == "listed":
+                self.messages_total = ev["total"]
+                self.stage = "descargando"
+            elif kind == "message":
+                self.messages_done = ev["i"]
+                self.files_seen += ev.get("files", 0)
+                self.log.append(f"[{ev['i']}/{ev['total']}] PDFs:{ev['pdfs']} From:{ev['from']} | {ev['subject']}")
+            elif kind in ("saved", "linked", "skipped"):
+                self.files_done += 1
+                self.bytes_saved += ev.get("size", 0)
+                self.log.append(f"{kind}: {ev.get('path') or ev.get('filename')}")
+            elif kind == "warning":
+                self.log.append(f"⚠ {ev['text']}")
+
+    def on_upload(self, sent: int, total: int):
+        with self._lock:
+            self.upload = (sent, total)
+
+    def _progress(self) -> float:
+        """
+        Fracción hecha (0..1). Con descarga, adjuntos terminados sobre adjuntos esperados;
+        mientras no se leyeron todos los mensajes, los esperados se extrapolan.
+        """
+        if self.status in ("done", "cancelled"):
+            return 1.0
+        if not self.messages_total:
+            return 0.0
+        if not self.params.get("download"):
+            return self.messages_done / self.messages_total
+        if not self.files_seen:
+            return 0.0
+        expected = self.files_seen * self.messages_total / max(self.messages_done, 1)
+        return min(self.files_done / expected, 1.0)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            progress = self._progress()
+            elapsed = ((self.finished or time.time()) - self.started) if self.started else 0.0
+            eta = None
+            if self.status == "running" and self.stage == "descargando" and 0.02 < progress < 1:
+                eta = elapsed * (1 - progress) / progress
+            return {
+                "id": self.id,
+                "params": dict(self.params),
+                "status": self.status,
+                "stage": self.stage,
+                "progress": round(progress, 4),
+                "elapsed_s": round(elapsed, 1),
+                "eta_s": round(eta) if eta is not None else None,
+                "messages": (self.messages_done, self.messages_total),
+                "files": (self.files_done, self.files_seen),
+                "bytes_saved": self.bytes_saved,
+                "upload": self.upload,
+                "log": list(self.log),
+                "summary": self.summary,
+                "zip_path": self.zip_path,
+                "sent_parts": self.sent_parts,
+                "error": self.error,
+                "cancel_requested": self.cancel.is_set(),
+            }
+
+
+def run_job(job: Job, gmail, cfg: dict, shared: dict = None):
+    """
+    Lo mismo que hace main.py, con progreso y cancelación: pipeline -> ZIP -> envío.
+    shared: argumentos extra para run_pipeline (el daemon pasa su state y cache abiertos).
+    """
+    p = job.params
+    lot_dir = None
+    if p.get("download") or p.get("zip") or p.get("send"):
+        lot_dir = ensure_lot_dir(cfg.get("output_dir", "data"), p["date_from"], p["date_to"])
+    job.set_stage("listando")
+    summary = run_pipeline(
+        gmail, cfg, p["date_from"], p["date_to"],
+        lot_dir=lot_dir,
+        download=p.get("download", False),
+        incremental=p.get("incremental", cfg.get("incremental", False)),
+        workers=p.get("workers") or cfg.get("workers", 4),
+        on_event=job.on_event,
+        cancel=job.cancel,
+        resume=True,  # si una corrida del mismo rango se cayó, se sigue desde ahí
+        **(shared or {}),
+    )
+    job.summary = {k: v for k, v in summary.items() if k != "csv_rows"}
+    if job.cancel.is_set():
+        return
+
+    if p.get("zip") or (p.get("send") and not p.get("delta")):
+        job.set_stage("zip")
+        job.zip_path = make_zip(lot_dir)
+    if p.get("send") and not job.cancel.is_set():
+        if not p.get("to_email"):
+            raise ValueError("Falta correo de contadora.")
+        job.set_stage("envío")
+        from delivery import send_lot
+        subject = f"Facturas DTE del {p['date_from']} al {p['date_to']}"
+        body = f"Adjunto ZIP del rango {p['date_from']} a {p['date_to']}.\nCarpeta: {lot_dir}"
+        if p.get("delta"):
+            subject = f"Facturas DTE nuevas del {p['date_from']} al {p['date_to']}"
+            body = f"Facturas del rango {p['date_from']} a {p['date_to']} que no iban en envíos anteriores (detalle en {DELTA_CSV}).\nCarpeta: {lot_dir}"
+        with _SEND_LOCK:
+            parts = send_lot(gmail, cfg, lot_dir, p["to_email"], subject, body, delta=p.get("delta", False),
+                             zip_path=job.zip_path, progress=job.on_upload,
+                             on_part=lambda k, n, part: job.set_stage(f"envío {k}/{n}"),
+                             state=(shared or {}).get("state"))
+        job.sent_parts = len(parts)
+
+
+class JobRunner:
+    """
+    Pool de corridas en segundo plano, aparte de los reruns de Streamlit (la UI lo
+    guarda con st.cache_resource). Corre hasta max_jobs a la vez; pedir de nuevo
+    exactamente lo mismo que ya está en curso devuelve ese job en vez de empezar otro.
+    Un pedido distinto sobre el mismo rango (p. ej. ahora con envío) espera a que
+    terminen los anteriores: comparten la carpeta del lote.
+    on_finish(job) se llama al terminar cada job (el daemon lo usa para el log).
+    """
+
+    def __init__(self, gmail_factory, cfg: dict, max_jobs: int = 2, keep: int = 20,
+                 shared: dict = None, on_finish=None):
+        self.gmail_factory = gmail_factory
+        self.cfg = cfg
+        self.keep = keep
+        self.shared = shared
+        self.on_finish = on_finish
+        self._pool = ThreadPoolExecutor(max_jobs, thread_name_prefix="job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, params: dict) -> Job:
+        rng = (params["date_from"], params["date_to"])
+        with self._lock:
+            same_range = [j for j in self._jobs.values() if j.status in ("queued", "running")
+                          and (j.params["date_from"], j.params["date_to"]) == rng]
+            for job in same_range:
+                if job.params == params:
+                    return job
+            job = Job(params)
+            job.after = same_range
+            self._jobs[job.id] = job
+            self._prune()
+        self._pool.submit(self._run, job)
+        return job
+
+    def _run(self, job: Job):
+        if job.after:
+            job.set_stage("esperando otro job del mismo rango")
+            for prev in job.after:
+                while not prev.finished_event.wait(0.5) and not job.cancel.is_set():
+                    pass
+            job.after = []
+        if job.cancel.is_set():
+            job.status, job.stage = "cancelled", "listo"
+            job.finished = job.started = time.time()
+            job.finished_event.set()
+            return
+        job.started, job.status = time.time(), "running"
+        try:
+            run_job(job, self.gmail_factory(), self.cfg, self.shared)
+            job.status = "cancelled" if job.cancel.is_set() else "done"
+        except Exception as e:
+            job.status, job.error = "failed", f"{type(e).__name__}: {e}"
+        finally:
+            job.finished = time.time()
+            job.set_stage("listo")
+            job.finished_event.set()
+            if self.on_finish:
+                self.on_finish(job)
+
+    def cancel(self, job_id: str):
+        job = self._jobs.get(job_id)
+        if job:
+            job.cancel.set()
+
+    def shutdown(self):
+        """Cancela lo que esté en cola o corriendo y espera a que termine."""
+        for job in list(self._jobs.values()):
+            job.cancel.set()
+        self._pool.shutdown(wait=True)
+
+    def get(self, job_id: str):
+        job = self._jobs.get(job_id)
+        return job.snapshot() if job else None
+
+    def jobs(self) -> list:
+        """Snapshots de todos los jobs, el más nuevo primero."""
+        with self._lock:
+            jobs = sorted(self._jobs.values(), key=lambda j: j.created, reverse=True)
+        return [j.snapshot() for j in jobs]
+
+    def active(self) -> bool:
+        return any(j.status in ("queued", "running") for j in list(self._jobs.values()))
+
+    def _prune(self):
+        # solo se recuerdan los últimos `keep` terminados
+        finished = sorted((j for j in self._jobs.values() if j.status not in ("queued", "running")),
+                          key=lambda j: j.created)
+        for job in finished[:max(0, len(finished) - self.keep)]:
+            del self._jobs[job.id]
@@ -0,0 +1,139 @@
+# src/journal.py
+import os, json, glob, threading, time
+try:
+    import fcntl
+except ImportError:  # Windows: sin flock, como antes
+    fcntl = None
+
+JOURNAL_DIR = "data/state/journal"
+
+# Bitácoras tomadas por este proceso: ruta -> archivo abierto con el flock exclusivo.
+# Mientras alguien la tiene (la corrida que la escribe o la que la está retomando),
+# otra corrida del mismo lote no la ve en unfinished().
+_HELD = {}
+_HELD_LOCK = threading.Lock()
+
+
+def _try_lock(f) -> bool:
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+class Journal:
+    """
+    Bitácora de una corrida (write-ahead): una línea JSON por adjunto ya puesto en
+    el lote, escrita ANTES de registrarlo en el estado. Si la corrida se cae (error,
+    cuota, Ctrl-C), --resume la relee, rehace el estado y el ledger/CSV y sigue por
+    los mensajes que faltaban.
+    Cada línea se pasa al sistema operativo al escribirla (sobrevive a que se caiga el
+    proceso); el fsync (que sobreviva a que se caiga la máquina) va por tandas: cada
+    fsync_every líneas o fsync_interval segundos.
+    Al terminar bien la corrida (ledger y CSV escritos) el archivo se borra.
+    Mientras el proceso la tenga abierta queda con flock exclusivo (ver unfinished):
+    close() la baja a disco pero la sigue reteniendo hasta remove() o release().
+    """
+
+    def __init__(self, path: str, fsync_every: int = 64, fsync_interval: float = 1.0):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._f = open(path, "a", encoding="utf-8")
+        _try_lock(self._f)  # archivo nuevo (lleva el pid): nadie más lo tiene
+        with _HELD_LOCK:
+            _HELD[path] = self._f
+        self._lock = threading.Lock()
+        self._closed = False
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def write(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":"), default=list) + "\n"
+        with self._lock:
+            self._f.write(line)
+            self._f.flush()
+            self._pending += 1
+            if self._pending >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync()
+
+    def _sync(self):
+        os.fsync(self._f.fileno())
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            if not self._closed and not self._f.closed:
+                self._sync()
+            self._closed = True
+
+
+def journal_path(lot: str, account: str = None, journal_dir: str = JOURNAL_DIR) -> str:
+    """Archivo nuevo para esta corrida: <journal_dir>/<lote>/<cuenta>-<fecha>-<pid>.jsonl"""
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    return os.path.join(journal_dir, lot, f"{account or 'default'}-{stamp}-{os.getpid()}.jsonl")
+
+
+def unfinished(lot: str, account: str = None, journal_dir: str = JOURNAL_DIR) -> list:
+    """
+    Bitácoras que quedaron de corridas cortadas para ese lote (y cuenta), de la más vieja
+    a la más nueva. Las que otra corrida viva todavía escribe (o retoma) están bloqueadas
+    y se saltean; las devueltas quedan tomadas por este proceso hasta remove()/release().
+    """
+    return claim(sorted(glob.glob(os.path.join(journal_dir, lot, f"{account or 'default'}-*.jsonl"))))
+
+
+def claim(paths) -> list:
+    """Toma el flock de cada bitácora que esté libre y devuelve esas (en el mismo orden)."""
+    out = []
+    for path in paths:
+        with _HELD_LOCK:
+            if path in _HELD:
+                continue
+            try:
+                f = open(path, "rb")
+            except FileNotFoundError:
+                continue
+            if _try_lock(f):
+                _HELD[path] = f
+                out.append(path)
+            else:
+                f.close()
+    return out
+
+
+def release(paths):
+    """Suelta las bitácoras tomadas (quedan en disco para un --resume posterior)."""
+    with _HELD_LOCK:
+        for path in paths:
+            f = _HELD.pop(path, None)
+            if f is not None:
+                f.close()
+
+
+def read(path: str) -> list:
+    """Registros de una bitácora. Una última línea a medio escribir (corte a mitad) se ignora."""
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                break
+    return records
+
+
+def remove(paths):
+    """Borra las bitácoras y recién después suelta el lock: nadie alcanza a retomarlas."""
+    paths = list(paths)
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    release(paths)
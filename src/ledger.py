@@ -0,0 +1,383 @@
+# src/ledger.py
+import os, csv, glob, tempfile, threading
+from contextlib import contextmanager
+from datetime import datetime
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from loguru import logger
+from dte import parse_dte
+from storage import write_csv_report
+
+LEDGER_DIR = "data/ledger"
+
+# Una fila por factura (o por mensaje sin DTE legible). El mes no va en el archivo:
+# sale de la carpeta de la partición (data/ledger/mes=YYYY-MM/part.parquet).
+SCHEMA = pa.schema([
+    ("id", pa.string()),               # codigoGeneracion, o msg:<messageId> si no hay DTE
+    ("fecha", pa.date32()),
+    ("tipo_dte", pa.string()),
+    ("codigo_generacion", pa.string()),
+    ("numero_control", pa.string()),
+    ("emisor_nit", pa.string()),
+    ("emisor_nombre", pa.string()),
+    ("receptor_nit", pa.string()),
+    ("receptor_nombre", pa.string()),
+    ("total_gravada", pa.float64()),
+    ("total_exenta", pa.float64()),
+    ("total_no_suj", pa.float64()),
+    ("total_iva", pa.float64()),
+    ("total_pagar", pa.float64()),
+    ("remitente", pa.string()),
+    ("asunto", pa.string()),
+    ("message_id", pa.string()),
+    ("lotes", pa.list_(pa.string())),  # lotes donde está la factura (pueden solaparse)
+    ("archivo_pdf", pa.string()),      # rutas relativas a la carpeta del lote
+    ("archivo_json", pa.string()),
+])
+MONEY = ["total_gravada", "total_exenta", "total_no_suj", "total_iva", "total_pagar"]
+
+# Agrupaciones de summarize()
+GROUPS = {
+    "emisor": ["emisor_nit", "emisor_nombre"],
+    "mes": ["mes"],
+    "tipo": ["tipo_dte"],
+}
+
+# Columnas del reporte.csv del lote: una fila por adjunto, las de siempre primero
+# (quien ya lee el reporte no se entera) y después los datos de su factura
+REPORT_FIELDS = ["fecha", "remitente", "asunto", "archivo_local", "messageId", "attachmentId"]
+DTE_FIELDS = [
+    "fecha_emision", "emisor_nombre", "emisor_nit", "tipo_dte", "numero_control", "codigo_generacion",
+    "total_gravada", "total_iva", "total_pagar",
+]
+CSV_FIELDS = REPORT_FIELDS + DTE_FIELDS
+
+
+try:
+    import fcntl
+except ImportError:  # Windows: solo el lock entre hilos
+    fcntl = None
+
+def _partition_path(ledger_dir: str, mes: str) -> str:
+    return os.path.join(ledger_dir, f"mes={mes}", "part.parquet")
+
+
+_PARTITION_LOCKS = {}
+_PARTITION_LOCKS_GUARD = threading.Lock()
+
+
+@contextmanager
+def _partition_lock(path: str):
+    """
+    Una partición la reescribe un escritor a la vez (leer, mezclar, reemplazar): lock
+    entre hilos (jobs de la UI/daemon) + flock sobre <mes>/.lock (procesos de accounts,
+    CLI y daemon a la vez).
+    """
+    with _PARTITION_LOCKS_GUARD:
+        lock = _PARTITION_LOCKS.setdefault(os.path.abspath(path), threading.Lock())
+    with lock, open(os.path.join(os.path.dirname(path), ".lock"), "a") as fh:
+        if fcntl:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def _to_date(value):
+    """YYYY-MM-DD o YYYYMMDD -> date (None si no se entiende)."""
+    value = str(value or "")
+    for fmt, n in (("%Y-%m-%d", 10), ("%Y%m%d", 8)):
+        try:
+            return datetime.strptime(value[:n], fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def entry_from_files(json_dte: dict, lot: str, message_id: str = "", remitente: str = None, asunto: str = None,
+                     archivo_json: str = None, archivo_pdf: str = None, fecha: str = None) -> dict:
+    """Arma la fila del ledger. json_dte: resultado de parse_dte (o None si el mensaje no trae DTE)."""
+    d = json_dte or {}
+    fecha_dte = _to_date(d.get("fec_emi"))
+    if fecha_dte is None and d.get("fec_emi"):
+        # fecEmi mal escrito: la factura no se pierde, queda con la fecha del correo
+        logger.warning(f"DTE {d.get('codigo_generacion') or archivo_json}: fecEmi ilegible "
+                       f"({d['fec_emi']!r}), se usa la fecha del correo ({fecha})")
+    row = {name: None for name in SCHEMA.names}
+    row.update({k: v for k, v in d.items() if k in row})
+    row.update({
+        "id": d.get("codigo_generacion") or f"msg:{message_id or archivo_pdf}",
+        "fecha": fecha_dte or _to_date(fecha),
+        "remitente": remitente,
+        "asunto": asunto,
+        "message_id": message_id,
+        "lotes": [lot],
+        "archivo_pdf": archivo_pdf,
+        "archivo_json": archivo_json,
+    })
+    return row
+
+
+def entries_from_rows(rows: list, lot_dir: str) -> list:
+    """
+    Filas del ledger a partir de los adjuntos guardados en la corrida (las del pipeline:
+    fecha, remitente, asunto, archivo_local, messageId, dte). Un mensaje con un DTE da
+    una fila con su PDF; uno sin DTE legible da una fila con solo los datos del correo.
+    """
+    lot = os.path.basename(lot_dir)
+    by_msg = {}
+    for r in rows:
+        by_msg.setdefault(r["messageId"], []).append({**r, "archivo_local": os.path.relpath(r["archivo_local"], lot_dir)})
+
+    entries = []
+    for mid, files in by_msg.items():
+        pdfs = [f["archivo_local"] for f in files if f["archivo_local"].lower().endswith(".pdf")]
+        dtes = [f for f in files if f.get("dte")]
+        first = files[0]
+        if not dtes:
+            entries.append(entry_from_files(None, lot, mid, first["remitente"], first["asunto"],
+                                            archivo_pdf=pdfs[0] if pdfs else first["archivo_local"],
+                                            fecha=first["fecha"]))
+            continue
+        for f in dtes:
+            # si hay varios DTE en el correo, el PDF con el mismo nombre base
+            stem = os.path.splitext(f["archivo_local"])[0]
+            pdf = next((p for p in pdfs if os.path.splitext(p)[0] == stem), pdfs[0] if len(dtes) == 1 and pdfs else None)
+            entries.append(entry_from_files(f["dte"], lot, mid, f["remitente"], f["asunto"],
+                                            archivo_json=f["archivo_local"], archivo_pdf=pdf, fecha=f["fecha"]))
+    return entries
+
+
+def _dataset(ledger_dir: str):
+    return ds.dataset(ledger_dir, format="parquet", schema=SCHEMA.append(pa.field("mes", pa.string())),
+                      partitioning=ds.partitioning(pa.schema([("mes", pa.string())]), flavor="hive"))
+
+
+def _join_split_messages(entries: list, ledger_dir: str):
+    """
+    Un mensaje cortado entre dos corridas (cancelada o caída) deja el PDF en una y el
+    JSON en otra: una fila msg:<id> con solo el PDF y otra del DTE sin PDF. Se juntan
+    en la fila del DTE. Devuelve (entradas, {mes: ids viejos a borrar}).
+    """
+    mids = [e["message_id"] for e in entries if e["message_id"]]
+    if not mids or not glob.glob(os.path.join(ledger_dir, "mes=*", "part.parquet")):
+        return entries, {}
+    old = {}
+    for o in _dataset(ledger_dir).to_table(filter=ds.field("message_id").isin(mids)).to_pylist():
+        old.setdefault(o["message_id"], []).append(o)
+
+    out, drop = [], {}
+    for e in entries:
+        same_lot = [o for o in old.get(e["message_id"], []) if set(o["lotes"] or []) & set(e["lotes"])]
+        if e["id"].startswith("msg:"):
+            # PDF que llega después: va a la fila del DTE que quedó sin PDF
+            target = next((o for o in same_lot if not o["id"].startswith("msg:") and not o["archivo_pdf"]), None)
+            if target and e["archivo_pdf"]:
+                mes = target.pop("mes")
+                e = {**target, "archivo_pdf": e["archivo_pdf"], "lotes": sorted(set(target["lotes"]) | set(e["lotes"]))}
+                drop.setdefault(mes, set()).add(target["id"])
+        else:
+            # DTE que llega después: absorbe la fila msg:<id> que tenía solo el PDF
+            for o in same_lot:
+                if o["id"].startswith("msg:"):
+                    if not e["archivo_pdf"]:
+                        e = {**e, "archivo_pdf": o["archivo_pdf"]}
+                    drop.setdefault(o["mes"], set()).add(o["id"])
+        out.append(e)
+    return out, drop
+
+
+def upsert(entries: list, ledger_dir: str = LEDGER_DIR) -> int:
+    """
+    Agrega/reemplaza filas por id, reescribiendo solo las particiones de los meses
+    tocados (temporal + rename). Si la factura ya estaba, se suman sus lotes.
+    Devuelve cuántas filas se escribieron.
+    """
+    entries, drop = _join_split_messages(entries, ledger_dir)
+    months = {mes: {} for mes in drop}
+    for e in entries:
+        if e["fecha"] is None:
+            logger.warning(f"Ledger: {e['id']} ({e['archivo_json'] or e['archivo_pdf']}) sin fecha legible, no se registra")
+            continue
+        bucket = months.setdefault(e["fecha"].strftime("%Y-%m"), {})
+        prev = bucket.get(e["id"])
+        if prev is not None:  # la misma factura en otro lote: gana la última, con ambos lotes
+            e = {**e, "lotes": sorted(set(prev["lotes"]) | set(e["lotes"]))}
+        bucket[e["id"]] = e
+
+    for mes, rows in months.items():
+        path = _partition_path(ledger_dir, mes)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with _partition_lock(path):
+            _rewrite_partition(path, rows, drop.get(mes, ()))
+    return sum(len(r) for r in months.values())
+
+
+def _rewrite_partition(path: str, rows: dict, drop):
+    """Mezcla rows ({id: fila}) con la partición, borra los ids de drop y la reemplaza de una vez."""
+    ids = pa.array(list(rows) + list(drop), pa.string())
+    old = pq.read_table(path, schema=SCHEMA) if os.path.exists(path) else SCHEMA.empty_table()
+    overlap = old.filter(pc.is_in(old["id"], value_set=ids)).select(["id", "lotes"]).to_pylist()
+    for r in overlap:
+        e = rows.get(r["id"])
+        if e is None:  # fila vieja que se borra (ver _join_split_messages)
+            continue
+        e["lotes"] = sorted(set(r["lotes"] or []) | set(e["lotes"]))
+    new = pa.Table.from_pylist(list(rows.values()), schema=SCHEMA)
+    if old.num_rows:
+        old = old.filter(pc.invert(pc.is_in(old["id"], value_set=ids)))
+        new = pa.concat_tables([old, new])
+    new = new.sort_by([("fecha", "ascending"), ("id", "ascending")])
+    # con punto: el dataset lo ignora
+    fd, tmp = tempfile.mkstemp(prefix=".part-", suffix=".parquet.tmp", dir=os.path.dirname(path))
+    os.close(fd)
+    try:
+        pq.write_table(new, tmp, compression="zstd")
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def load(ledger_dir: str = LEDGER_DIR, date_from: str = None, date_to: str = None, lot: str = None) -> pa.Table:
+    """
+    Tabla del ledger (con la columna mes). Los filtros de fecha se aplican al leer:
+    los meses fuera del rango ni se abren.
+    """
+    if not glob.glob(os.path.join(ledger_dir, "mes=*", "part.parquet")):
+        return SCHEMA.append(pa.field("mes", pa.string())).empty_table()
+    dataset = _dataset(ledger_dir)
+    flt = None
+
+    def _and(a, b):
+        return b if a is None else a & b
+
+    if date_from:
+        flt = _and(flt, (ds.field("mes") >= date_from[:7]) & (ds.field("fecha") >= _to_date(date_from)))
+    if date_to:
+        flt = _and(flt, (ds.field("mes") <= date_to[:7]) & (ds.field("fecha") <= _to_date(date_to)))
+    table = dataset.to_table(filter=flt)
+    if lot:
+        # filas cuya lista de lotes contiene lot
+        lotes = table["lotes"]
+        hits = pc.list_parent_indices(lotes).filter(pc.equal(pc.list_flatten(lotes), lot))
+        table = table.take(pc.unique(hits))
+    return table
+
+
+def summarize(by: str = "emisor", date_from: str = None, date_to: str = None,
+              ledger_dir: str = LEDGER_DIR) -> list:
+    """Totales agrupados por emisor, mes o tipo de DTE, del mayor al menor total a pagar."""
+    table = load(ledger_dir, date_from, date_to)
+    keys = GROUPS[by]
+    agg = table.group_by(keys).aggregate([(c, "sum") for c in MONEY] + [("id", "count")])
+    agg = agg.rename_columns([name.replace("_sum", "").replace("id_count", "facturas") for name in agg.column_names])
+    for c in MONEY:
+        agg = agg.set_column(agg.schema.get_field_index(c), c, pc.round(agg[c], 2))
+    order = [("mes", "ascending")] if by == "mes" else [("total_pagar", "descending")]
+    return agg.sort_by(order).to_pylist()
+
+
+def _read_report(csv_path: str) -> list:
+    """Filas (columnas de siempre) del reporte.csv existente; [] si no hay o es de otro formato."""
+    if not os.path.exists(csv_path):
+        return []
+    with open(csv_path, "r", newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        if not set(REPORT_FIELDS) <= set(reader.fieldnames or []):
+            return []
+        return [{k: r[k] for k in REPORT_FIELDS} for r in reader]
+
+
+def export_lot_csv(lot_dir: str, ledger_dir: str = LEDGER_DIR, rows: list = ()):
+    """
+    Reescribe reporte.csv del lote: una fila por archivo guardado (las de corridas anteriores
+    salen del reporte que ya estaba, por archivo_local, así volver a correr no duplica) con
+    los datos de su factura en el ledger a continuación.
+    rows: filas nuevas de la corrida (las del pipeline). None si el lote no tiene filas.
+    """
+    by_key = {}
+    for r in _read_report(os.path.join(lot_dir, "reporte.csv")) + [{k: r.get(k) for k in REPORT_FIELDS} for r in rows]:
+        by_key[r["archivo_local"]] = r
+    if not by_key:
+        return None
+
+    lot_abs = os.path.abspath(lot_dir)
+    invoices = {}  # ruta relativa al lote (PDF o JSON) -> factura
+    table = load(ledger_dir, lot=os.path.basename(lot_dir))
+    for inv in table.filter(pc.invert(pc.starts_with(table["id"], "msg:"))).to_pylist():
+        for k in ("archivo_pdf", "archivo_json"):
+            if inv[k]:
+                invoices[os.path.normpath(inv[k])] = inv
+
+    out = []
+    for r in by_key.values():
+        inv = invoices.get(os.path.relpath(os.path.abspath(r["archivo_local"] or ""), lot_abs))
+        if inv:
+            r.update({k: inv.get(k) for k in DTE_FIELDS}, fecha_emision=inv["fecha"])
+        out.append(r)
+    out.sort(key=lambda r: (r["fecha"] or "", r["archivo_local"] or ""))
+    return write_csv_report(lot_dir, out, CSV_FIELDS)
+
+
+def rebuild(downloads_dir: str = "data/downloads", ledger_dir: str = LEDGER_DIR) -> int:
+    """
+    Arma el ledger desde los JSON ya descargados (lotes de antes del ledger).
+    Cada subcarpeta de mensaje: sus JSON de DTE + el PDF que los acompaña.
+    """
+    entries = []
+    for lot_dir in sorted(glob.glob(os.path.join(downloads_dir, "*"))):
+        if not os.path.isdir(lot_dir) or os.path.basename(lot_dir) == "out":
+            continue
+        lot = os.path.basename(lot_dir)
+        for msg_dir in sorted(glob.glob(os.path.join(lot_dir, "*"))):
+            if not os.path.isdir(msg_dir) or os.path.basename(msg_dir).startswith("."):
+                continue
+            pdfs = sorted(glob.glob(os.path.join(msg_dir, "*.pdf")))
+            for json_path in sorted(glob.glob(os.path.join(msg_dir, "*.json"))):
+                with open(json_path, "rb") as f:
+                    dte = parse_dte(f.read())
+                if dte is None:
+                    continue
+                stem = os.path.splitext(json_path)[0]
+                pdf = next((p for p in pdfs if os.path.splitext(p)[0] == stem), pdfs[0] if pdfs else None)
+                entries.append(entry_from_files(dte, lot, archivo_json=os.path.relpath(json_path, lot_dir),
+                                                archivo_pdf=os.path.relpath(pdf, lot_dir) if pdf else None,
+                                                fecha=os.path.basename(msg_dir)[:8]))
+    return upsert(entries, ledger_dir)
+
+
+if __name__ == "__main__":
+    # python src/ledger.py summary --by emisor --from 2025-01-01 --to 2025-12-31
+    # python src/ledger.py export data/downloads/2025-08-01_2025-08-31
+    # python src/ledger.py rebuild
+    import argparse, time
+    ap = argparse.ArgumentParser(description="Ledger de facturas (Parquet, una partición por mes).")
+    sub = ap.add_subparsers(dest="command", required=True)
+    s = sub.add_parser("summary", help="Totales por emisor, mes o tipo de DTE")
+    s.add_argument("--by", choices=sorted(GROUPS), default="emisor")
+    s.add_argument("--from", dest="date_from")
+    s.add_argument("--to", dest="date_to")
+    e = sub.add_parser("export", help="Completa reporte.csv de un lote con los datos del ledger")
+    e.add_argument("lot_dir")
+    sub.add_parser("rebuild", help="Carga al ledger los JSON de los lotes ya descargados")
+    ap.add_argument("--ledger-dir", default=LEDGER_DIR)
+    args = ap.parse_args()
+
+    if args.command == "summary":
+        t0 = time.perf_counter()
+        rows = summarize(args.by, args.date_from, args.date_to, args.ledger_dir)
+        keys = GROUPS[args.by]
+        for r in rows:
+            label = " | ".join(str(r[k] or "-") for k in keys)
+            print(f"{label:<50} {r['facturas']:>6}  IVA {r['total_iva'] or 0:>12,.2f}  Total {r['total_pagar'] or 0:>14,.2f}")
+        print(f"({len(rows)} grupos en {time.perf_counter() - t0:.3f}s)")
+    elif args.command == "export":
+        print(export_lot_csv(args.lot_dir, args.ledger_dir) or "El lote no tiene reporte.csv")
+    else:
+        print(f"Ledger: {rebuild(ledger_dir=args.ledger_dir)} filas")
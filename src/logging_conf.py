@@ -1,9 +1,16 @@
 from loguru import logger
-import sys
+from datetime import datetime
+import os, sys
+
+# Identificador de la corrida: nombra el log y los archivos que van junto a él
+RUN_ID = datetime.now().strftime("%Y-%m-%d_%H%M%S")
+
+def run_artifact(suffix: str = "") -> str:
+    """Ruta logs/run_<RUN_ID><suffix> (p. ej. ".log", ".prof")."""
+    return os.path.join("logs", f"run_{RUN_ID}{suffix}")
 
 def setup_logging(): 
     logger.remove()
     logger.add(sys.stdout, level="INFO", enqueue=True, backtrace=False, diagnose=False)
-    logger.add("logs/run_{time}.log", level="DEBUG", rotation="5 MB", retention="7 days")
+    logger.add(run_artifact(".log"), level="DEBUG", rotation="5 MB", retention="7 days")
     return logger
-    
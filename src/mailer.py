@@ -1,24 +1,105 @@
 # src/mailer.py
-import os, base64, mimetypes
-from email.message import EmailMessage
+import os, base64, mimetypes, tempfile, uuid
+from email.header import Header
+from email.message import MIMEPart
+from email.policy import SMTP
+from email.utils import encode_rfc2231
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseUpload
+from metrics import METRICS
+from scheduler import SCHEDULER, QUOTA_UNITS, is_throttle, retry_after, should_retry
 
-def send_mail_with_attachment(gmail, to_email: str, subject: str, body_text: str, attachment_path: str):
+UPLOAD_CHUNK = 1024 * 1024        # múltiplo de 256 KB (requisito de la subida reanudable)
+SPOOL_MAX = 1024 * 1024           # MIME en memoria hasta 1 MB; después va a disco
+B64_BLOCK = 57 * 1024             # 57 bytes = una línea base64 de 76 caracteres
+
+
+def _write_mime(fh, to_email: str, subject: str, body_text: str, attachment_path: str):
     """
-    Envía un correo con un adjunto usando Gmail API.
+    Escribe el correo MIME (texto + adjunto en base64) directo a fh, leyendo el
+    adjunto por bloques: nunca tiene el archivo completo en memoria.
     """
-    msg = EmailMessage()
-    msg["To"] = to_email
-    msg["Subject"] = subject
-    msg.set_content(body_text)
-
     ctype, encoding = mimetypes.guess_type(attachment_path)
     if ctype is None or encoding is not None:
         ctype = "application/octet-stream"
-    maintype, subtype = ctype.split("/", 1)
 
+    filename = os.path.basename(attachment_path)
+    if filename.isascii():
+        disposition = f'attachment; filename="{filename}"'
+    else:
+        disposition = f"attachment; filename*={encode_rfc2231(filename, 'utf-8')}"
+
+    text = MIMEPart()
+    text.set_content(body_text)
+
+    # encode() pliega las líneas largas con "\n" suelto si no se le pasa linesep
+    subject_header = Header(subject, "utf-8", header_name="Subject").encode(linesep="\r\n")
+    boundary = f"=_dte_{uuid.uuid4().hex}"
+    head = (
+        f"To: {to_email}\r\n"
+        f"Subject: {subject_header}\r\n"
+        "MIME-Version: 1.0\r\n"
+        f'Content-Type: multipart/mixed; boundary="{boundary}"\r\n'
+        "\r\n"
+        f"--{boundary}\r\n"
+    )
+    fh.write(head.encode("ascii"))
+    fh.write(text.as_bytes(policy=SMTP))
+    fh.write(
+        (
+            f"\r\n--{boundary}\r\n"
+            f"Content-Type: {ctype}\r\n"
+            "Content-Transfer-Encoding: base64\r\n"
+            f"Content-Disposition: {disposition}\r\n"
+            "\r\n"
+        ).encode("ascii")
+    )
     with open(attachment_path, "rb") as f:
-        data = f.read()
-    msg.add_attachment(data, maintype=maintype, subtype=subtype, filename=os.path.basename(attachment_path))
+        while True:
+            block = f.read(B64_BLOCK)
+            if not block:
+                break
+            fh.write(base64.encodebytes(block).replace(b"\n", b"\r\n"))
+    fh.write(f"\r\n--{boundary}--\r\n".encode("ascii"))
+
+
+def send_mail_with_attachment(gmail, to_email: str, subject: str, body_text: str, attachment_path: str,
+                              progress=None, max_retries: int = 5):
+    """
+    Envía un correo con un adjunto usando Gmail API.
+    El MIME se arma en un archivo temporal y se sube por la ruta de media con
+    subida reanudable en bloques de UPLOAD_CHUNK: memoria constante, y si un bloque
+    falla se reintenta ese bloque (no toda la subida), con el backoff del SCHEDULER.
+    progress(enviados, total): callback opcional por cada bloque confirmado.
+    """
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX) as fh:
+        _write_mime(fh, to_email, subject, body_text, attachment_path)
+        fh.seek(0)
+
+        media = MediaIoBaseUpload(fh, mimetype="message/rfc822", chunksize=UPLOAD_CHUNK, resumable=True)
+        request = gmail.users().messages().send(userId="me", body={}, media_body=media)
+
+        SCHEDULER.acquire(QUOTA_UNITS["messages.send"])
+        METRICS.inc("gmail_api_calls_total", endpoint="messages.send")
+        response, failures = None, 0
+        while response is None:
+            try:
+                status, response = request.next_chunk(num_retries=2)
+            except HttpError as e:
+                if not should_retry(e) or failures >= max_retries:
+                    raise
+                # la librería retoma desde el último byte que Gmail confirmó
+                if is_throttle(e):
+                    SCHEDULER.on_throttle()
+                SCHEDULER.backoff(failures, retry_after(e))
+                failures += 1
+                continue
+            failures = 0
+            if status is not None and progress:
+                progress(status.resumable_progress, status.total_size)
 
-    raw = base64.urlsafe_b64encode(msg.as_bytes()).decode()
-    gmail.users().messages().send(userId="me", body={"raw": raw}).execute()
+        METRICS.inc("bytes_uploaded_total", media.size())
+        if progress:
+            total = media.size()
+            progress(total, total)
+        return response
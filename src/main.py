@@ -1,27 +1,12 @@
 # src/main.py
-import argparse, os, yaml
+import argparse, os, time, yaml
 from dotenv import load_dotenv
-from logging_conf import setup_logging
-from filters import build_gmail_query
-from gmail_client import (
-    get_gmail_service,
-    search_messages,
-    get_message,
-    count_pdf_attachments,   # solo para loguear cuántos PDFs detecta
-    download_attachments,    # usamos esta para PDF + JSON
-)
-from state import load_processed, append_processed
-from storage import (
-    ensure_lot_dir,
-    ensure_message_dir,          # nuevo: subcarpeta por correo
-    build_standard_filename,
-    save_pdf_bytes,
-    append_csv_report,
-    make_zip,
-    sha256_bytes,
-    load_hash_index,
-    save_hash_index,
-)
+from logging_conf import setup_logging, run_artifact
+from gmail_client import get_gmail_service
+from pipeline import run_pipeline
+from accounts import account_configs, run_accounts
+from metrics import METRICS
+from storage import DELTA_CSV, ensure_lot_dir, make_zip
 
 def load_config():
     with open("config/config.yaml", "r", encoding="utf-8") as f:
@@ -34,97 +19,187 @@ def parse_args():
     ap.add_argument("--download", action="store_true", help="Descargar y guardar adjuntos en disco")
     ap.add_argument("--zip", action="store_true", help="Crear ZIP del lote")
     ap.add_argument("--send", action="store_true", help="Enviar correo a la contadora con el ZIP")
+    ap.add_argument("--workers", type=int, default=None, help="Descargas de adjuntos en paralelo (default: config.yaml)")
+    ap.add_argument("--incremental", action="store_true", help="Listar solo correo nuevo desde la corrida anterior (history API)")
+    ap.add_argument("--profile", action="store_true", help="Guardar un perfil cProfile de la corrida en logs/run_<id>.prof")
+    ap.add_argument("--account", action="append", default=None, help="Procesar solo esta cuenta de 'accounts' (repetible)")
+    ap.add_argument("--resume", action="store_true", help="Retomar una corrida cortada del mismo lote (su bitácora en data/state/journal)")
+    ap.add_argument("--delta", action="store_true", help="Con --send: mandar solo lo que la contadora todavía no recibió de este lote (en partes de hasta max_zip_mb)")
+    ap.add_argument("--submit", action="store_true", help="Mandar la corrida al daemon (python src/daemon.py serve) en vez de correrla acá")
+    ap.add_argument("--wait", action="store_true", help="Con --submit: seguir el progreso del job hasta que termine")
     return ap.parse_args()
 
+def log_event(logger):
+    """Traduce los eventos del pipeline a líneas de log."""
+    reasons = {
+        "processed": "ya procesado ese adjunto",
+        "hash": "archivo idéntico ya guardado en este lote",
+        "dte": "factura ya registrada (mismo codigoGeneracion)",
+    }
+
+    def _log(ev):
+        kind = ev["event"]
+        tag = f"[{ev['account']}] " if "account" in ev else ""  # varias cuentas: de qué buzón es cada línea
+        info = lambda text: logger.info(tag + text)
+        if kind == "query":
+            info(f"Query Gmail: {ev['query']}")
+        elif kind == "sync":
+            info(f"Sync incremental: {ev['added']} mensajes nuevos en el buzón, {ev['matched']} del rango")
+        elif kind == "shards":
+            info(f"Listado por tramos: {ev['total']} tramos, {ev['cached']} cerrados ya en caché")
+        elif kind == "listed":
+            info(f"Mensajes encontrados: {ev['total']}")
+        elif kind == "message":
+            info(f"[{ev['i']:03d}] PDFs:{ev['pdfs']}  From:{ev['from']}  Subject:{ev['subject']}")
+        elif kind == "skipped":
+            info(f"         ↷ Omitido ({reasons[ev['reason']]}): {ev['filename']}")
+        elif kind == "saved":
+            info(f"         ✓ Guardado: {ev['path']}")
+        elif kind == "linked":
+            info(f"         ↪ Enlazado (ya estaba en otro lote): {ev['path']}")
+        elif kind == "resumed":
+            info(f"Retomando {ev['journals']} corrida(s) cortada(s): {ev['rows']} archivos recuperados, "
+                 f"{ev['done']} mensajes ya terminados")
+        elif kind == "warning":
+            logger.warning(tag + ev["text"])
+    return _log
+
 def main():
     load_dotenv()
     logger = setup_logging()
     cfg = load_config()
     args = parse_args()
 
-    # Armar query Gmail
-    query = build_gmail_query(cfg["keywords"], args.date_from, args.date_to, cfg.get("label"))
-    logger.info(f"Query Gmail: {query}")
-
-    gmail = get_gmail_service()
-    ids = search_messages(gmail, query, max_results=cfg.get("max_results", 100))
-    logger.info(f"Mensajes encontrados: {len(ids)}")
-
+    if args.submit:
+        return submit(cfg, args, logger)
+
+    if cfg.get("accounts"):
+        # Varias cuentas: cada proceso del pool abre su propio servicio; acá solo hace
+        # falta uno para enviar el correo (la cuenta "send_account" o la primera).
+        gmail = None
+        if args.send:
+            sender = cfg.get("send_account")
+            acc = next((a for a in account_configs(cfg) if a["name"] == sender), None) or account_configs(cfg)[0]
+            gmail = get_gmail_service(acc["credentials"], acc["token"])
+    else:
+        gmail = get_gmail_service()
+
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    summary = None
+    try:
+        summary = run(gmail, cfg, args, logger)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(run_artifact(".prof"))
+            logger.info(f"Perfil cProfile: {run_artifact('.prof')}")
+        run_info = {"args": vars(args)}
+        if summary:
+            run_info.update({k: v for k, v in summary.items() if k != "csv_rows"})
+        json_path, prom_path = METRICS.write(run_artifact(), run_info)
+        logger.info(f"Métricas de la corrida: {json_path} / {prom_path}")
+
+def submit(cfg, args, logger):
+    """
+    Encola la corrida en el daemon, que ya tiene el servicio y el estado cargados.
+    Con --wait sigue el progreso (Ctrl-C deja de seguirlo, el job sigue en el daemon).
+    """
+    from daemon import SOCKET_PATH, request
+    path = cfg.get("daemon_socket", SOCKET_PATH)
+    params = {
+        "date_from": args.date_from, "date_to": args.date_to,
+        "download": args.download, "zip": args.zip, "send": args.send,
+        "to_email": os.getenv("CONTADORA_EMAIL") or cfg.get("contadora_email"),
+        "incremental": args.incremental or cfg.get("incremental", False),
+        "workers": args.workers,
+        "delta": args.delta,
+    }
+    try:
+        job = request({"cmd": "submit", "params": params}, path)["job"]
+    except RuntimeError as e:
+        logger.error(str(e))
+        raise SystemExit(1)
+    logger.info(f"Job {job['id']} en el daemon ({job['status']}): python src/daemon.py jobs para ver la cola")
+    if not args.wait:
+        return
+
+    last = None
+    try:
+        while job["status"] in ("queued", "running"):
+            time.sleep(0.25)
+            job = request({"cmd": "get", "id": job["id"]}, path)["job"]
+            (done, total), (files_done, _) = job["messages"], job["files"]
+            line = f"[{job['id']}] {job['stage']}: mensajes {done}/{total}, adjuntos {files_done}"
+            if line != last:
+                logger.info(line)
+                last = line
+    except KeyboardInterrupt:
+        logger.info(f"Job {job['id']} sigue en el daemon (python src/daemon.py cancel {job['id']} para cortarlo)")
+        return
+    summary = job["summary"] or {}
+    if summary.get("csv_path"):
+        logger.info(f"Reporte CSV: {summary['csv_path']}")
+    if job["zip_path"]:
+        logger.info(f"ZIP creado: {job['zip_path']}")
+    if job["status"] == "failed":
+        logger.error(f"Job {job['id']} falló: {job['error']}")
+        raise SystemExit(1)
+    logger.info(f"Job {job['id']} {job['status']} en {job['elapsed_s']}s: "
+                f"{summary.get('saved', 0)} guardados, TOTAL PDFs en rango: {summary.get('total_pdfs', 0)}")
+
+def run(gmail, cfg, args, logger) -> dict:
     lot_dir = None
     if args.download or args.zip or args.send:
         lot_dir = ensure_lot_dir(cfg.get("output_dir", "data"), args.date_from, args.date_to)
         logger.info(f"Carpeta de lote: {lot_dir}")
 
-    # --- DEDUPE ---
-    state_path = "data/state/processed.jsonl"
-    seen = load_processed(state_path)
-    lot_hashes = load_hash_index(lot_dir) if lot_dir else set()
-
-    total_pdfs = 0
-    csv_buffer = []
-    processed_keys_to_append = []
-
-    for i, mid in enumerate(ids, 1):
-        msg = get_message(gmail, mid)
-
-        pdfs = count_pdf_attachments(msg)
-        total_pdfs += pdfs
-
-        headers = {h["name"].lower(): h["value"] for h in msg["payload"].get("headers", [])}
-        subj = headers.get("subject", "(sin asunto)")
-        frm  = headers.get("from", "(sin remitente)")
-        logger.info(f"[{i:03d}] PDFs:{pdfs}  From:{frm}  Subject:{subj}")
-
-        # Descargar PDF + JSON
-        atts = download_attachments(gmail, msg, exts=("pdf","json"))
-        logger.info(f"      -> Adjuntos listos: {len(atts)}")
-
-        # Crear subcarpeta para este mensaje
-        msg_dir = None
-        if args.download and atts:
-            msg_dir = ensure_message_dir(lot_dir, msg)
-
-        if args.download and atts:
-            for a in atts:
-                unique_key = f"{mid}:{a['attachment_id']}"
-                if unique_key in seen:
-                    logger.info("         ↷ Omitido (ya procesado ese adjunto).")
-                    continue
-
-                h = sha256_bytes(a["data"])
-                if h in lot_hashes:
-                    logger.info("         ↷ Omitido (archivo idéntico ya guardado en este lote).")
-                    processed_keys_to_append.append(unique_key)
-                    continue
-
-                std_name = build_standard_filename(msg, a["filename"])
-                out_path = save_pdf_bytes(msg_dir or lot_dir, std_name, a["data"])
-                logger.info(f"         ✓ Guardado: {out_path}")
-
-                lot_hashes.add(h)
-                csv_buffer.append({
-                    "fecha": std_name[:8],  # YYYYMMDD
-                    "remitente": frm,
-                    "asunto": subj,
-                    "archivo_local": out_path,
-                    "messageId": mid,
-                    "attachmentId": a["attachment_id"],
-                })
-                processed_keys_to_append.append(unique_key)
-
-    # Guardar estado y hashes
-    if processed_keys_to_append:
-        append_processed(state_path, processed_keys_to_append)
-    if lot_dir is not None:
-        save_hash_index(lot_dir, lot_hashes)
-
-    if args.download and csv_buffer:
-        csv_path = append_csv_report(lot_dir, csv_buffer)
-        logger.info(f"Reporte CSV: {csv_path}")
+    try:
+        if cfg.get("accounts"):
+            summary = run_accounts(
+                cfg, args.date_from, args.date_to,
+                lot_dir=lot_dir,
+                download=args.download,
+                incremental=args.incremental or cfg.get("incremental", False),
+                workers=args.workers,
+                on_event=log_event(logger),
+                only=args.account,
+                resume=args.resume,
+            )
+            for name, acc in summary["accounts"].items():
+                logger.info(
+                    f"[{name}] {acc['messages']} mensajes, {acc['total_pdfs']} PDFs, {acc['saved']} guardados, "
+                    f"{acc['skipped_processed'] + acc['skipped_hash'] + acc['skipped_dte']} omitidos ({acc['elapsed_s']}s)"
+                )
+            for name, err in summary["errors"].items():
+                logger.error(f"[{name}] Cuenta no procesada: {err}")
+        else:
+            summary = run_pipeline(
+                gmail, cfg, args.date_from, args.date_to,
+                lot_dir=lot_dir,
+                download=args.download,
+                incremental=args.incremental or cfg.get("incremental", False),
+                workers=args.workers or cfg.get("workers", 4),
+                on_event=log_event(logger),
+                resume=args.resume,
+            )
+    except (Exception, KeyboardInterrupt) as e:
+        # solo si se cortó el pipeline: lo de después (ZIP, envío) no deja bitácora
+        if args.download:
+            logger.error(f"Corrida interrumpida ({type(e).__name__}). Lo guardado quedó en la bitácora: "
+                         f"repetir el mismo comando con --resume para seguir desde ahí")
+        raise
+
+    if summary["csv_path"]:
+        logger.info(f"Reporte CSV: {summary['csv_path']}")
 
     zip_path = None
     if args.zip:
-        zip_path = make_zip(lot_dir)
+        with METRICS.stage("zip"):
+            zip_path = make_zip(lot_dir)
         size_mb = os.path.getsize(zip_path) / (1024 * 1024)
         logger.info(f"ZIP creado: {zip_path} ({size_mb:.2f} MB)")
 
@@ -132,20 +207,41 @@ def main():
         to = os.getenv("CONTADORA_EMAIL") or cfg.get("contadora_email")
         if not to:
             logger.error("Falta CONTADORA_EMAIL en .env o 'contadora_email' en config.yaml")
-            return
-        if not zip_path:
-            zip_path = make_zip(lot_dir)
+            return summary
+        if not zip_path and not args.delta:
+            with METRICS.stage("zip"):
+                zip_path = make_zip(lot_dir)
         subject = f"Facturas DTE del {args.date_from} al {args.date_to}"
         body = (
             f"Adjunto ZIP con las facturas del {args.date_from} al {args.date_to}.\n\n"
             f"Carpeta de lote: {lot_dir}\n"
             f"Si necesitas los archivos individuales o el CSV de reporte, avísame."
         )
-        from mailer import send_mail_with_attachment
-        send_mail_with_attachment(gmail, to, subject, body, zip_path)
-        logger.info(f"Correo enviado a: {to}")
-
-    logger.info(f"TOTAL PDFs en rango: {total_pdfs}")
+        if args.delta:
+            subject = f"Facturas DTE nuevas del {args.date_from} al {args.date_to}"
+            body = (
+                f"Adjunto las facturas del {args.date_from} al {args.date_to} que no iban en los envíos anteriores "
+                f"(su detalle en {DELTA_CSV}).\n\n"
+                f"Carpeta de lote: {lot_dir}\n"
+            )
+        from delivery import send_lot
+        progress = lambda sent, total: logger.info(f"Subiendo ZIP: {sent / total:.0%} ({sent}/{total} bytes)")
+        on_part = lambda k, n, part: logger.info(
+            f"Enviando {os.path.basename(part['path'])} ({k}/{n}): {len(part['files'])} archivos, "
+            f"{part['bytes'] / (1024 * 1024):.2f} MB")
+        with METRICS.stage("send"):
+            parts = send_lot(gmail, cfg, lot_dir, to, subject, body, delta=args.delta, zip_path=zip_path,
+                             progress=progress, on_part=on_part)
+        if parts:
+            logger.info(f"Correo enviado a: {to}" + (f" ({len(parts)} partes)" if len(parts) > 1 else ""))
+        else:
+            logger.info(f"Nada nuevo para {to}: ya recibió todo lo de este lote")
+    elif args.delta:
+        logger.warning("--delta solo aplica con --send")
+
+    logger.info(f"Caché de mensajes: {summary['cache_hits']} aciertos, {summary['cache_misses']} pedidos a Gmail")
+    logger.info(f"TOTAL PDFs en rango: {summary['total_pdfs']}")
+    return summary
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,56 @@
+# src/message.py
+from gmail_client import count_pdf_attachments, iter_attachments
+from storage import message_names
+
+
+class MessageRecord:
+    """
+    Lo que el bot usa de un mensaje de Gmail, ya parseado: headers, nombres para
+    disco y descriptores de adjuntos. Se arma una vez (parse_message) y el payload
+    completo se suelta enseguida; por las colas del pipeline viaja solo esto.
+    """
+    __slots__ = ("id", "internal_date", "subject", "sender", "ymd", "sender_name", "folder",
+                 "pdfs", "attachments")
+
+    def __init__(self, id, internal_date, subject, sender, ymd, sender_name, folder, pdfs, attachments):
+        self.id = id
+        self.internal_date = internal_date
+        self.subject = subject
+        self.sender = sender
+        self.ymd = ymd
+        self.sender_name = sender_name
+        self.folder = folder
+        self.pdfs = pdfs
+        self.attachments = attachments
+
+    def __repr__(self):
+        return f"MessageRecord({self.id!r}, {self.subject!r}, adjuntos={len(self.attachments)})"
+
+
+def parse_message(msg: dict, exts=("pdf", "json")) -> MessageRecord:
+    """
+    Mensaje de la API (messages.get) -> MessageRecord.
+    attachments: descriptores de iter_attachments (solo exts), sin bajar nada.
+    """
+    subject = sender = None
+    for h in msg.get("payload", {}).get("headers", []):
+        name = h["name"].lower()
+        if name == "subject":
+            subject = h["value"]
+        elif name == "from":
+            sender = h["value"]
+    if subject is None:
+        subject = "(sin asunto)"
+    internal_date = int(msg.get("internalDate", 0) or 0)
+    ymd, sender_name, folder = message_names(msg["id"], internal_date, subject, sender or "")
+    return MessageRecord(
+        id=msg["id"],
+        internal_date=internal_date,
+        subject=subject,
+        sender=sender if sender is not None else "(sin remitente)",
+        ymd=ymd,
+        sender_name=sender_name,
+        folder=folder,
+        pdfs=count_pdf_attachments(msg),
+        attachments=list(iter_attachments(msg, exts)),
+    )
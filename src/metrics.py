@@ -0,0 +1,202 @@
+# src/metrics.py
+import json, os, threading, time
+from contextlib import contextmanager
+
+# Límites (segundos) de los histogramas de latencia
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def _escape_label(value) -> str:
+    """Valor de etiqueta en formato texto de Prometheus: escapa \\, " y saltos de línea."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape_label(v)}"' for k, v in items) + "}"
+
+
+class Metrics:
+    """
+    Métricas de una corrida, en memoria y thread-safe:
+      - contadores con etiquetas (llamadas a la API por endpoint, bytes, dedupe)
+      - histogramas de latencia
+      - tiempo por etapa (segundos acumulados; en etapas con varios hilos es
+        tiempo ocupado sumado, no reloj de pared)
+    Al final se vuelcan a un JSON y a un archivo de texto para Prometheus.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.counters = {}
+            self.histograms = {}
+            self.stages = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        k = _key(name, labels)
+        with self._lock:
+            self.counters[k] = self.counters.get(k, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        k = _key(name, labels)
+        with self._lock:
+            h = self.histograms.get(k)
+            if h is None:
+                h = self.histograms[k] = {"buckets": [0] * len(LATENCY_BUCKETS), "count": 0, "sum": 0.0}
+            for i, le in enumerate(LATENCY_BUCKETS):
+                if seconds <= le:
+                    h["buckets"][i] += 1
+                    break
+            h["count"] += 1
+            h["sum"] += seconds
+
+    def add_time(self, stage: str, seconds: float):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - t0)
+
+    def counter(self, name: str, **labels) -> float:
+        with self._lock:
+            return self.counters.get(_key(name, labels), 0)
+
+    # --- entre procesos (una cuenta por proceso, ver accounts.py) ---
+    def dump(self) -> dict:
+        """Contadores crudos, picklables, para mandarlos al proceso padre."""
+        with self._lock:
+            return {
+                "counters": list(self.counters.items()),
+                "histograms": [(k, {**h, "buckets": list(h["buckets"])}) for k, h in self.histograms.items()],
+                "stages": dict(self.stages),
+            }
+
+    def merge(self, data: dict, **labels):
+        """Suma un dump() de otro proceso; labels se agrega a cada métrica (p. ej. account=...)."""
+        extra = tuple(labels.items())
+        with self._lock:
+            for (name, lbls), v in data["counters"]:
+                k = (name, tuple(sorted(lbls + extra)))
+                self.counters[k] = self.counters.get(k, 0) + v
+            for (name, lbls), h in data["histograms"]:
+                k = (name, tuple(sorted(lbls + extra)))
+                mine = self.histograms.setdefault(k, {"buckets": [0] * len(LATENCY_BUCKETS), "count": 0, "sum": 0.0})
+                mine["buckets"] = [a + b for a, b in zip(mine["buckets"], h["buckets"])]
+                mine["count"] += h["count"]
+                mine["sum"] += h["sum"]
+            for stage, secs in data["stages"].items():
+                self.stages[stage] = self.stages.get(stage, 0.0) + secs
+
+    # --- salida ---
+    def snapshot(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = {k: {**h, "buckets": list(h["buckets"])} for k, h in self.histograms.items()}
+            stages = dict(self.stages)
+
+        def by_label(name, label):
+            out = {}
+            for (n, lbls), v in counters.items():
+                if n == name:  # suma el resto de etiquetas (p. ej. account)
+                    k = dict(lbls).get(label, "")
+                    out[k] = out.get(k, 0) + v
+            return out
+
+        def total(name):
+            return sum(v for (n, _), v in counters.items() if n == name)
+
+        dedupe = {}
+        for kind, checks in by_label("dedupe_checks_total", "kind").items():
+            hits = by_label("dedupe_hits_total", "kind").get(kind, 0)
+            dedupe[kind] = {"checks": checks, "hits": hits, "hit_rate": round(hits / checks, 4) if checks else 0.0}
+
+        merged = {}
+        for (name, lbls), h in histograms.items():
+            m = merged.setdefault(dict(lbls).get("endpoint", name), {"buckets": [0] * len(LATENCY_BUCKETS), "count": 0, "sum": 0.0})
+            m["buckets"] = [a + b for a, b in zip(m["buckets"], h["buckets"])]
+            m["count"] += h["count"]
+            m["sum"] += h["sum"]
+        latency = {}
+        for endpoint, h in merged.items():
+            latency[endpoint] = {
+                "count": h["count"],
+                "mean_s": round(h["sum"] / h["count"], 4) if h["count"] else 0.0,
+                "buckets": {str(le): c for le, c in zip(LATENCY_BUCKETS, h["buckets"])},
+            }
+
+        return {
+            "started": self.started,
+            "elapsed_s": round(time.time() - self.started, 3),
+            "stages_s": {k: round(v, 4) for k, v in sorted(stages.items())},
+            "api_calls": by_label("gmail_api_calls_total", "endpoint"),
+            "api_retries": by_label("gmail_api_retries_total", "endpoint"),
+            "bytes": {
+                "downloaded": total("bytes_downloaded_total"),
+                "written": total("bytes_written_total"),
+                "zipped": total("bytes_zipped_total"),
+                "uploaded": total("bytes_uploaded_total"),
+            },
+            "latency": latency,
+            "dedupe": dedupe,
+        }
+
+    def to_prometheus(self, prefix: str = "dte_") -> str:
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = {k: dict(h) for k, h in self.histograms.items()}
+            stages = dict(self.stages)
+        lines = []
+        for name in sorted({n for n, _ in counters}):
+            lines.append(f"# TYPE {prefix}{name} counter")
+            for (n, lbls), v in sorted(counters.items()):
+                if n == name:
+                    lines.append(f"{prefix}{name}{_fmt_labels(lbls)} {v}")
+        for name in sorted({n for n, _ in histograms}):
+            lines.append(f"# TYPE {prefix}{name} histogram")
+            for (n, lbls), h in sorted(histograms.items()):
+                if n != name:
+                    continue
+                acc = 0
+                for le, c in zip(LATENCY_BUCKETS, h["buckets"]):
+                    acc += c
+                    lines.append(f"{prefix}{name}_bucket{_fmt_labels(lbls, [('le', le)])} {acc}")
+                lines.append(f"{prefix}{name}_bucket{_fmt_labels(lbls, [('le', '+Inf')])} {h['count']}")
+                lines.append(f"{prefix}{name}_sum{_fmt_labels(lbls)} {h['sum']}")
+                lines.append(f"{prefix}{name}_count{_fmt_labels(lbls)} {h['count']}")
+        lines.append(f"# TYPE {prefix}stage_seconds gauge")
+        for stage, secs in sorted(stages.items()):
+            lines.append(f"{prefix}stage_seconds{_fmt_labels([('stage', stage)])} {secs}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, base_path: str, extra: dict = None) -> tuple:
+        """Escribe <base>.summary.json y <base>.prom; devuelve ambas rutas."""
+        os.makedirs(os.path.dirname(base_path) or ".", exist_ok=True)
+        summary = self.snapshot()
+        if extra:
+            summary["run"] = extra
+        json_path, prom_path = base_path + ".summary.json", base_path + ".prom"
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2, default=str)
+        with open(prom_path, "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+        return json_path, prom_path
+
+
+# Métricas compartidas por todo el proceso
+METRICS = Metrics()
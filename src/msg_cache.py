@@ -0,0 +1,110 @@
+# src/msg_cache.py
+import os, json, sqlite3, threading, time
+
+
+class MessageCache:
+    """
+    Caché persistente (SQLite) de mensajes ya leídos de Gmail, por messageId.
+    Un correo recibido no cambia, así que guardamos la respuesta del perfil usado
+    ("lean"/"metadata"): encabezados, internalDate y el árbol de partes con los
+    descriptores de adjuntos. Se expulsan los menos usados al pasar de max_bytes
+    (al guardar, no solo al cerrar: en el daemon la caché queda abierta días).
+    Se puede usar desde varios hilos (las operaciones se serializan con un lock).
+    """
+
+    def __init__(self, path: str = "data/state/messages.sqlite", max_bytes: int = 200 * 1024 * 1024):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)  # varias cuentas = varios procesos
+        self._lock = threading.Lock()
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS messages (
+                   id TEXT NOT NULL,
+                   profile TEXT NOT NULL,
+                   data TEXT NOT NULL,
+                   size INTEGER NOT NULL,
+                   last_used REAL NOT NULL,
+                   PRIMARY KEY (id, profile)
+               )"""
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS ix_messages_last_used ON messages(last_used)")
+        self._db.commit()
+        # tamaño aproximado (REPLACE y otros procesos lo desvían); _evict lo recalcula exacto
+        self._bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM messages").fetchone()[0]
+
+    def get_many(self, ids, profile: str) -> dict:
+        """Devuelve {id: mensaje} para los ids que están en caché."""
+        with self._lock:
+            return self._get_many(list(ids), profile)
+
+    def _get_many(self, ids, profile):
+        found = {}
+        for start in range(0, len(ids), 500):  # límite de variables de SQLite
+            group = ids[start:start + 500]
+            marks = ",".join("?" * len(group))
+            rows = self._db.execute(
+                f"SELECT id, data FROM messages WHERE profile = ? AND id IN ({marks})",
+                [profile, *group],
+            )
+            for mid, data in rows:
+                found[mid] = json.loads(data)
+        if found:
+            now = time.time()
+            self._db.executemany(
+                "UPDATE messages SET last_used = ? WHERE id = ? AND profile = ?",
+                [(now, mid, profile) for mid in found],
+            )
+            self._db.commit()
+        self.hits += len(found)
+        self.misses += len(ids) - len(found)
+        return found
+
+    def put_many(self, messages, profile: str):
+        with self._lock:
+            self._put_many(messages, profile)
+
+    def _put_many(self, messages, profile):
+        now = time.time()
+        rows = []
+        for msg in messages:
+            data = json.dumps(msg, ensure_ascii=False, separators=(",", ":"))
+            rows.append((msg["id"], profile, data, len(data), now))
+        self._db.executemany(
+            "INSERT OR REPLACE INTO messages (id, profile, data, size, last_used) VALUES (?, ?, ?, ?, ?)",
+            rows,
+        )
+        self._db.commit()
+        self._bytes += sum(r[3] for r in rows)
+        if self._bytes > self.max_bytes:
+            self._evict()
+
+    def evict(self):
+        """Si la caché pasa de max_bytes, borra los menos usados hasta quedar en ~90%."""
+        with self._lock:
+            return self._evict()
+
+    def _evict(self):
+        total = self._bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM messages").fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+        target = total - int(self.max_bytes * 0.9)
+        freed, removed = 0, []
+        cur = self._db.execute("SELECT id, profile, size FROM messages ORDER BY last_used")
+        for mid, profile, size in cur:
+            removed.append((mid, profile))
+            freed += size
+            if freed >= target:
+                break
+        cur.close()
+        self._db.executemany("DELETE FROM messages WHERE id = ? AND profile = ?", removed)
+        self._db.commit()
+        self._bytes = total - freed
+        return len(removed)
+
+    def close(self):
+        self.evict()
+        self._db.close()
@@ -0,0 +1,548 @@
+# src/pipeline.py
+import asyncio, os, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+from googleapiclient.errors import HttpError
+from dte import parse_dte
+from filters import build_gmail_query, message_matches, split_date_range
+from blobs import BlobStore
+import journal
+from gmail_client import (
+    SEARCH_PAGE_MAX,
+    search_messages,
+    get_history_id,
+    get_label_id,
+    list_history_added,
+    get_messages_batch,
+    fetch_attachment_b64,
+    thread_http,
+)
+from message import parse_message
+from metrics import METRICS
+from msg_cache import MessageCache
+from scheduler import SCHEDULER
+from state import open_state, load_sync_state, save_sync_state
+from storage import (
+    ensure_message_dir,
+    build_standard_filename,
+    ensure_tmp_dir,
+    stream_b64_to_temp,
+    commit_temp,
+    link_blob,
+    discard_temp,
+)
+
+SYNC_PATH = "data/state/sync.json"
+BATCH_SIZE = 50   # ids por batch de messages.get
+_DONE = object()  # fin de cola
+
+
+def search_sharded(gmail, cfg, date_from, date_to, state, emit=None):
+    """
+    Lista el rango por tramos (config "shard": day/week) en paralelo, con páginas
+    de SEARCH_PAGE_MAX, y une los ids sin duplicados (del tramo más nuevo al más viejo,
+    como los devuelve Gmail). Los tramos que terminaron antes de ayer ya no reciben
+    correo: su lista de ids se guarda en el estado y las siguientes corridas no
+    los vuelven a listar.
+    """
+    emit = emit or (lambda ev: None)
+    tz = ZoneInfo(cfg["timezone"]) if cfg.get("timezone") else None
+    closed_before = datetime.now(tz).date() - timedelta(days=1)
+    shards = split_date_range(date_from, date_to, cfg.get("shard", "day"))
+    # con varias cuentas la misma query da ids distintos: el caché va por cuenta
+    prefix = f"{cfg['account']}|" if cfg.get("account") else ""
+
+    def _list(shard):
+        query = build_gmail_query(cfg["keywords"], shard[0], shard[1], cfg.get("label"))
+        closed = date.fromisoformat(shard[1]) < closed_before
+        if closed:
+            ids = state.get_listing(prefix + query)
+            if ids is not None:
+                return ids, True
+        ids = search_messages(gmail, query, max_results=SEARCH_PAGE_MAX, http=thread_http(gmail))
+        if closed:
+            state.save_listing(prefix + query, ids)
+        return ids, False
+
+    with ThreadPoolExecutor(max_workers=cfg.get("list_concurrency", 4)) as pool:
+        results = list(pool.map(_list, reversed(shards)))
+
+    emit({"event": "shards", "total": len(shards), "cached": sum(1 for _, cached in results if cached)})
+    return list(dict.fromkeys(mid for ids, _ in results for mid in ids))
+
+
+def list_message_ids(gmail, cfg, query, date_from, date_to, incremental=False, cache=None,
+                     state=None, emit=None, http=None):
+    """
+    Ids de mensajes del rango. En modo incremental reutiliza los ids de la corrida
+    anterior con la misma query y solo pide a la history API lo agregado desde
+    el historyId guardado; si no hay estado o expiró, hace el listado completo
+    (por tramos si hay "shard" en config y un StateStore).
+    """
+    emit = emit or (lambda ev: None)
+
+    def _full_listing():
+        if state is not None and cfg.get("shard", "day"):
+            return search_sharded(gmail, cfg, date_from, date_to, state, emit)
+        return search_messages(gmail, query, max_results=cfg.get("max_results", 100), http=http)
+
+    if not incremental:
+        return _full_listing()
+
+    sync_path = SYNC_PATH.replace(".json", f"-{cfg['account']}.json") if cfg.get("account") else SYNC_PATH
+    sync = load_sync_state(sync_path)
+    entry = sync.get(query)
+    label_id = get_label_id(gmail, cfg.get("label"), http=http)
+
+    ids = None
+    if entry:
+        try:
+            added, history_id = list_history_added(gmail, entry["history_id"], label_id, http=http)
+        except HttpError as e:
+            if e.resp.status != 404:
+                raise
+            emit({"event": "warning", "text": "historyId expirado; se hace listado completo"})
+        else:
+            new_ids = []
+            if added:
+                known = set(entry["ids"])
+                candidates = [mid for mid in added if mid not in known]
+                for msg in get_messages_batch(gmail, candidates, profile="metadata", cache=cache, http=http):
+                    if message_matches(msg, cfg["keywords"], date_from, date_to,
+                                       label_id, cfg.get("timezone")):
+                        new_ids.append(msg["id"])
+            emit({"event": "sync", "added": len(added), "matched": len(new_ids)})
+            ids = new_ids + entry["ids"]
+
+    if ids is None:
+        # el historyId se toma ANTES de listar: lo que llegue durante el listado
+        # vuelve a aparecer en la siguiente corrida (y el dedupe lo absorbe)
+        history_id = get_history_id(gmail, http=http)
+        ids = _full_listing()
+
+    sync[query] = {"history_id": history_id, "ids": ids}
+    save_sync_state(sync_path, sync)
+    return ids
+
+
+def replay_journals(paths, state, lot) -> dict:
+    """
+    Rehace lo que dejaron corridas cortadas (ver journal.py): registra en el estado los
+    adjuntos que alcanzaron a quedar en el lote y devuelve sus filas (solo si el archivo
+    sigue ahí), los mensajes ya terminados y el listado original.
+    """
+    out = {"query": None, "ids": None, "rows": [], "done": set()}
+    for path in paths:
+        for rec in journal.read(path):
+            t = rec["t"]
+            if t == "run" and out["query"] is None:
+                out["query"] = rec["query"]
+            elif t == "listed" and out["ids"] is None:
+                out["ids"] = rec["ids"]
+            elif t == "saved":
+                state.record_saved(rec["key"], rec["sha256"], lot, rec["path"],
+                                   dte=rec.get("dte"), relpath=rec.get("relpath"))
+                if os.path.exists(rec["path"]):
+                    out["rows"].append(rec["row"])
+            elif t == "skipped":
+                state.mark_processed([rec["key"]])
+            elif t == "done":
+                out["done"].add(rec["id"])
+    return out
+
+
+def run_pipeline(gmail, cfg, date_from, date_to, lot_dir=None, download=False,
+                 incremental=False, workers=None, on_event=None, export=True, cancel=None,
+                 resume=False, state=None, cache=None) -> dict:
+    """
+    Corre la descarga como un pipeline por etapas, cada una con su propio límite
+    de concurrencia y colas acotadas entre ellas:
+
+        listado -> metadatos (batch) -> descarga de adjuntos -> guardado en disco
+
+    Si el disco o la API van lentos, las colas se llenan y las etapas anteriores
+    esperan (backpressure). Lo usan el CLI y la UI.
+    Con dte_dedupe (config, activo por defecto) el JSON del DTE se baja primero: si su
+    codigoGeneracion ya está en el índice de facturas, el PDF del mensaje no se pide.
+    Con blob_store, los adjuntos se guardan una vez en data/blobs y los lotes son enlaces;
+    un adjunto ya guardado para otro lote se enlaza en este sin volver a bajarlo.
+    on_event(dict): recibe eventos de progreso (siempre desde el hilo que llamó).
+    export=False deja las filas sin pasar al ledger/CSV (varias cuentas: lo hace el
+    proceso principal una sola vez, ver accounts.py).
+    cancel (threading.Event): si se activa, la corrida para después de lo que esté en
+    curso; lo ya guardado queda registrado y exportado ("cancelled": True en el resumen),
+    así otra corrida sigue desde ahí.
+    Con descarga, cada adjunto guardado se anota antes en una bitácora (journal.py) que se
+    borra cuando el ledger y el CSV quedan escritos. Si la corrida se cae a la mitad,
+    resume=True relee esas bitácoras: recupera sus filas para el reporte y sigue con los
+    mensajes que faltaban, sin volver a listar.
+    state / cache: StateStore y MessageCache ya abiertos (el daemon los mantiene entre
+    corridas); si no se pasan, se abren acá y se cierran al terminar.
+    Devuelve un resumen con totales, filas del CSV y ruta del reporte.
+    """
+    query = build_gmail_query(cfg["keywords"], date_from, date_to, cfg.get("label"))
+    emit = on_event or (lambda ev: None)
+    emit({"event": "query", "query": query})
+    SCHEDULER.configure(cfg.get("quota_units_per_sec", 250))
+
+    own_state, own_cache = state is None, cache is None
+    if own_state:
+        state = open_state("data/state", cfg.get("output_dir", "data"))
+    if own_cache:
+        cache = MessageCache(max_bytes=cfg.get("message_cache_mb", 200) * 1024 * 1024)
+    hits0, misses0 = cache.hits, cache.misses
+    jr, old, replay = None, [], None
+    if download:
+        lot = os.path.basename(lot_dir)
+        old = journal.unfinished(lot, cfg.get("account"))
+        if old and resume:
+            replay = replay_journals(old, state, lot)
+            if replay["query"] != query:
+                replay["ids"] = None  # cambió la config: se vuelve a listar
+            emit({"event": "resumed", "journals": len(old), "rows": len(replay["rows"]),
+                  "done": len(replay["done"])})
+        elif old:
+            emit({"event": "warning", "text": f"Hay {len(old)} corrida(s) cortada(s) de este lote sin terminar: "
+                                              "con --resume se recupera lo que alcanzaron a guardar"})
+            journal.release(old)
+            old = []
+        jr = journal.Journal(journal.journal_path(lot, cfg.get("account")),
+                             fsync_every=cfg.get("journal_fsync_every", 64))
+        jr.write({"t": "run", "query": query, "date_from": date_from, "date_to": date_to})
+    try:
+        try:
+            with METRICS.stage("pipeline"):
+                summary = asyncio.run(_pipeline(
+                    gmail, cfg, query, date_from, date_to, lot_dir, download, incremental,
+                    workers or cfg.get("workers", 4), emit, state, cache, cancel, jr, replay,
+                ))
+        finally:
+            if own_cache:
+                cache.close()
+            if own_state:
+                state.close()
+            if jr:
+                jr.close()  # si algo falló la bitácora queda para --resume
+        summary["cache_hits"], summary["cache_misses"] = cache.hits - hits0, cache.misses - misses0
+        METRICS.inc("dedupe_checks_total", summary["cache_hits"] + summary["cache_misses"], kind="message_cache")
+        METRICS.inc("dedupe_hits_total", summary["cache_hits"], kind="message_cache")
+
+        # Las descargas terminan en cualquier orden; se ordenan como los mensajes
+        rows = sorted(summary.pop("rows"), key=lambda r: r.pop("seq"))
+        if replay:
+            rows = replay["rows"] + rows
+        summary["csv_rows"] = rows
+        summary["csv_path"] = finalize_lot(cfg, lot_dir, rows) if download and export else None
+        journals = old + [jr.path] if jr else []
+        if export:
+            journal.remove(journals)
+        else:
+            summary["journals"] = journals  # las borra quien exporte (accounts.py)
+    except BaseException:
+        # quedan en disco para --resume, pero libres para otra corrida
+        journal.release(old + ([jr.path] if jr else []))
+        raise
+    return summary
+
+
+def finalize_lot(cfg, lot_dir, rows):
+    """Pasa lo guardado al ledger y reescribe el CSV del lote desde ahí (sin duplicados)."""
+    import ledger  # pyarrow tarda en importar: solo cuando hay algo que exportar
+    with METRICS.stage("ledger"):
+        ledger_dir = os.path.join(cfg.get("output_dir", "data"), "ledger")
+        ledger.upsert(ledger.entries_from_rows(rows, lot_dir), ledger_dir)
+        return ledger.export_lot_csv(lot_dir, ledger_dir, rows)
+
+
+async def _pipeline(gmail, cfg, query, date_from, date_to, lot_dir, download, incremental,
+                    workers, emit, state, cache, cancel=None, jr=None, replay=None):
+    loop = asyncio.get_running_loop()
+    meta_workers = cfg.get("metadata_concurrency", 4)
+    queue_size = cfg.get("queue_size", 256)
+    lot = os.path.basename(lot_dir) if lot_dir else None
+    tmp_dir = ensure_tmp_dir(lot_dir) if download else None
+
+    pools = {
+        "list": ThreadPoolExecutor(1, thread_name_prefix="list"),
+        "meta": ThreadPoolExecutor(meta_workers, thread_name_prefix="meta"),
+        "fetch": ThreadPoolExecutor(workers, thread_name_prefix="fetch"),
+        "disk": ThreadPoolExecutor(1, thread_name_prefix="disk"),
+    }
+    q_ids = asyncio.Queue(maxsize=meta_workers * 2)
+    q_att = asyncio.Queue(maxsize=queue_size)
+    q_disk = asyncio.Queue(maxsize=queue_size)
+
+    summary = {"query": query, "messages": 0, "total_pdfs": 0, "saved": 0,
+               "skipped_processed": 0, "skipped_hash": 0, "skipped_dte": 0, "linked": 0,
+               "cancelled": False, "rows": []}
+    messages = {}  # mid -> MessageRecord, mientras le queden adjuntos por guardar
+    dirs = {}      # mid -> subcarpeta del mensaje en el lote (se crea con el primer archivo)
+    dir_names = {}  # carpeta -> nombres ya usados en esta corrida (colisiones sin sondear el disco)
+
+    dte_dedupe = download and cfg.get("dte_dedupe", True)
+    claimed = set()                               # codigoGeneracion tomados en esta corrida
+    gate_slots = asyncio.Semaphore(workers * 2)   # mensajes esperando su JSON
+    gates = []
+    blobs = BlobStore(os.path.join(cfg.get("output_dir", "data"), "blobs")) \
+        if download and cfg.get("blob_store", True) else None
+    log = jr.write if jr else (lambda rec: None)
+    outstanding = {}  # mid -> adjuntos del mensaje que faltan guardar u omitir
+    outstanding_lock = threading.Lock()
+
+    def _settle(mid):
+        # un adjunto menos; el mensaje completo queda "done" en la bitácora
+        with outstanding_lock:
+            outstanding[mid] -= 1
+            if outstanding[mid]:
+                return
+            del outstanding[mid]
+            messages.pop(mid, None)
+            dirs.pop(mid, None)
+        log({"t": "done", "id": mid})
+
+    # --- funciones que corren en los pools (bloqueantes) ---
+    def _list():
+        return list_message_ids(gmail, cfg, query, date_from, date_to, incremental, cache, state,
+                                emit=lambda ev: loop.call_soon_threadsafe(emit, ev),
+                                http=thread_http(gmail))
+
+    def _fetch_group(group):
+        # se parsea en el hilo que lo trae: el payload completo no sale de acá
+        return [parse_message(msg) for msg in get_messages_batch(gmail, group, cache=cache, http=thread_http(gmail))]
+
+    def _fetch_to_temp(desc):
+        b64 = fetch_attachment_b64(gmail, desc["message_id"], desc["attachment_id"], http=thread_http(gmail))
+        res = {**desc, **stream_b64_to_temp(tmp_dir, b64)}
+        if desc["filename"].lower().endswith(".json"):
+            # los JSON son chicos: se leen ya para el índice de facturas y el ledger
+            with open(res["tmp_path"], "rb") as f:
+                res["dte"] = parse_dte(f.read())
+        return res
+
+    def _persist(res):
+        mid = res["message_id"]
+        rec = messages[mid]
+        key = f"{mid}:{res['attachment_id']}"
+        if "link" in res:
+            return _link_saved(res, rec, key)
+        METRICS.inc("dedupe_checks_total", kind="hash")
+        if state.hash_in_lot(res["sha256"], lot):
+            METRICS.inc("dedupe_hits_total", kind="hash")
+            discard_temp(res["tmp_path"])
+            log({"t": "skipped", "key": key})
+            state.mark_processed([key])
+            return None
+        if mid not in dirs:
+            dirs[mid] = ensure_message_dir(lot_dir, rec)
+        std_name = build_standard_filename(rec, res["filename"])
+        out_path = commit_temp(res["tmp_path"], dirs[mid], std_name, res["sha256"], blobs, dir_names)
+        relpath = os.path.relpath(out_path, lot_dir) if blobs else None
+        row = _row(res, rec, out_path, res.get("dte"))
+        _log_saved(key, res["sha256"], out_path, row, dte=res.get("dte"), relpath=relpath)
+        state.record_saved(key, res["sha256"], lot, out_path, dte=res.get("dte"), relpath=relpath)
+        return row
+
+    def _link_saved(res, rec, key):
+        # ya se bajó para otro lote: el blob se enlaza con la misma ruta relativa
+        saved = res["link"]
+        rel_dir, name = os.path.split(saved["relpath"])
+        out_path = link_blob(blobs, saved["sha256"], os.path.join(lot_dir, rel_dir), name, dir_names)
+        dte = None
+        if name.lower().endswith(".json"):
+            with open(out_path, "rb") as f:
+                dte = parse_dte(f.read())
+        row = _row(res, rec, out_path, dte)
+        _log_saved(key, saved["sha256"], out_path, row)
+        state.record_saved(key, saved["sha256"], lot, out_path)
+        return row
+
+    def _log_saved(key, sha256, out_path, row, dte=None, relpath=None):
+        # antes que el estado: si se corta entre las dos, --resume lo registra igual
+        log({"t": "saved", "key": key, "sha256": sha256, "path": out_path, "dte": dte,
+             "relpath": relpath, "row": {k: v for k, v in row.items() if k != "seq"}})
+
+    def _row(res, rec, out_path, dte):
+        return {
+            "seq": res["seq"],
+            "fecha": os.path.basename(out_path)[:8],  # YYYYMMDD
+            "remitente": rec.sender,
+            "asunto": rec.subject,
+            "archivo_local": out_path,
+            "messageId": res["message_id"],
+            "attachmentId": res["attachment_id"],
+            "dte": dte,
+        }
+
+    async def run_in(pool, fn, *args):
+        # tiempo ocupado por etapa: suma de lo que tardan sus tareas en el pool
+        t0 = time.perf_counter()
+        try:
+            return await loop.run_in_executor(pools[pool], fn, *args)
+        finally:
+            METRICS.add_time(f"pipeline.{pool}", time.perf_counter() - t0)
+
+    # --- etapas ---
+    async def list_stage():
+        if replay and replay["ids"] is not None:
+            # se retoma una corrida cortada: su listado, menos los mensajes ya terminados
+            listed = replay["ids"]
+            ids = [mid for mid in listed if mid not in replay["done"]]
+        else:
+            ids = listed = await run_in("list", _list)
+        log({"t": "listed", "ids": listed})
+        summary["messages"] = len(ids)
+        emit({"event": "listed", "total": len(ids)})
+        for start in range(0, len(ids), BATCH_SIZE):
+            await q_ids.put((start, ids[start:start + BATCH_SIZE]))
+        for _ in range(meta_workers):
+            await q_ids.put(_DONE)
+
+    async def meta_stage():
+        while (item := await q_ids.get()) is not _DONE:
+            start, group = item
+            msgs = await run_in("meta", _fetch_group, group)
+            for k, rec in enumerate(msgs):
+                i = start + k + 1
+                mid = rec.id
+                summary["total_pdfs"] += rec.pdfs
+                atts = rec.attachments if download else []
+                emit({"event": "message", "i": i, "total": summary["messages"], "id": mid,
+                      "pdfs": rec.pdfs, "files": len(atts), "from": rec.sender, "subject": rec.subject})
+                if not download:
+                    continue  # dry run: no se descarga ningún adjunto
+
+                pending, links = [], []
+                for j, desc in enumerate(atts):
+                    key = f"{mid}:{desc['attachment_id']}"
+                    METRICS.inc("dedupe_checks_total", kind="processed")
+                    if state.is_processed(key):
+                        METRICS.inc("dedupe_hits_total", kind="processed")
+                        saved = state.saved_attachment(key) if blobs else None
+                        if saved and blobs.has(saved["sha256"]) and not state.hash_in_lot(saved["sha256"], lot):
+                            desc.update(seq=(i, j), link=saved)
+                            links.append(desc)  # sin descarga: directo a disco
+                            continue
+                        summary["skipped_processed"] += 1
+                        emit({"event": "skipped", "reason": "processed", "filename": desc["filename"]})
+                        continue
+                    desc["seq"] = (i, j)  # para ordenar el CSV como antes
+                    pending.append(desc)
+
+                if links or pending:
+                    messages[mid] = rec
+                    outstanding[mid] = len(links) + len(pending)
+                else:
+                    log({"t": "done", "id": mid})
+                for desc in links:
+                    await q_disk.put(desc)
+                jsons = [d for d in pending if d["filename"].lower().endswith(".json")] if dte_dedupe else []
+                if jsons:
+                    await gate_slots.acquire()
+                    others = [d for d in pending if d not in jsons]
+                    gates.append(asyncio.create_task(dte_gate(jsons, others)))
+                else:
+                    for desc in pending:
+                        await q_att.put(desc)
+
+    async def dte_gate(jsons, others):
+        """
+        Baja los JSON del mensaje y busca su codigoGeneracion en el índice de facturas.
+        Si todos son facturas ya registradas, el mensaje es un reenvío: no se piden
+        sus PDFs. Si no, los JSON van a disco y el resto a la cola de descargas.
+        """
+        try:
+            results = await asyncio.gather(*(run_in("fetch", _fetch_to_temp, d) for d in jsons))
+            known = 0
+            for res in results:
+                dte = res["dte"]
+                if dte is None:
+                    await q_disk.put(res)
+                    continue
+                METRICS.inc("dedupe_checks_total", kind="dte")
+                code = dte["codigo_generacion"]
+                if code in claimed or state.invoice_known(code):
+                    METRICS.inc("dedupe_hits_total", kind="dte")
+                    known += 1
+                    discard_temp(res["tmp_path"])
+                    _skip_dte(res)
+                    continue
+                claimed.add(code)
+                await q_disk.put(res)
+
+            if known == len(results):
+                for desc in others:
+                    _skip_dte(desc)
+            else:
+                for desc in others:
+                    await q_att.put(desc)
+        finally:
+            gate_slots.release()
+
+    def _skip_dte(desc):
+        key = f"{desc['message_id']}:{desc['attachment_id']}"
+        log({"t": "skipped", "key": key})
+        state.mark_processed([key])
+        summary["skipped_dte"] += 1
+        emit({"event": "skipped", "reason": "dte", "filename": desc["filename"]})
+        _settle(desc["message_id"])
+
+    async def fetch_stage():
+        while (desc := await q_att.get()) is not _DONE:
+            res = await run_in("fetch", _fetch_to_temp, desc)
+            await q_disk.put(res)
+
+    def _persist_and_count(res):
+        # el resumen se actualiza en el mismo hilo que escribe: si la corrida se cancela
+        # con un archivo a medio guardar, igual queda en las filas (y en el ledger)
+        row = _persist(res)
+        if row is None:
+            summary["skipped_hash"] += 1
+            ev = {"event": "skipped", "reason": "hash", "filename": res["filename"]}
+        elif "link" in res:
+            summary["linked"] += 1
+            summary["rows"].append(row)
+            ev = {"event": "linked", "path": row["archivo_local"]}
+        else:
+            summary["saved"] += 1
+            summary["rows"].append(row)
+            ev = {"event": "saved", "path": row["archivo_local"], "size": res["size"]}
+        _settle(res["message_id"])
+        loop.call_soon_threadsafe(emit, ev)
+
+    async def disk_stage():
+        while (res := await q_disk.get()) is not _DONE:
+            await run_in("disk", _persist_and_count, res)
+
+    async def meta_all():
+        await asyncio.gather(*(meta_stage() for _ in range(meta_workers)))
+        await asyncio.gather(*gates)
+        for _ in range(workers):
+            await q_att.put(_DONE)
+
+    async def fetch_all():
+        await asyncio.gather(*(fetch_stage() for _ in range(workers)))
+        await q_disk.put(_DONE)
+
+    async def watch_cancel(stages):
+        while not cancel.is_set():
+            await asyncio.sleep(0.2)
+        stages.cancel()
+
+    stages = asyncio.gather(list_stage(), meta_all(), fetch_all(), disk_stage())
+    watcher = asyncio.create_task(watch_cancel(stages)) if cancel is not None else None
+    try:
+        await stages
+    except asyncio.CancelledError:
+        if not (cancel and cancel.is_set()):
+            raise
+        for task in gates:
+            task.cancel()
+        summary["cancelled"] = True
+        emit({"event": "cancelled"})
+    finally:
+        if watcher:
+            watcher.cancel()
+        for pool in pools.values():
+            pool.shutdown(wait=True, cancel_futures=True)
+    return summary
@@ -0,0 +1,146 @@
+# src/scheduler.py
+import json, random, threading, time
+from email.utils import parsedate_to_datetime
+from googleapiclient.errors import HttpError
+from metrics import METRICS
+
+# Costo de cada endpoint en unidades de cuota de Gmail
+# (https://developers.google.com/gmail/api/reference/quota)
+QUOTA_UNITS = {
+    "messages.list": 5,
+    "messages.get": 5,
+    "attachments.get": 5,
+    "messages.send": 100,
+    "history.list": 2,
+    "labels.list": 1,
+    "getProfile": 1,
+}
+USER_RATE_LIMIT = 250   # unidades/segundo por usuario
+RATE_LIMIT_REASONS = ("rateLimitExceeded", "userRateLimitExceeded")
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+
+def _error_reason(e: HttpError) -> str:
+    try:
+        err = json.loads(e.content.decode("utf-8"))["error"]
+        return (err.get("errors") or [{}])[0].get("reason", "")
+    except Exception:
+        return ""
+
+
+def is_throttle(e: HttpError) -> bool:
+    """429, o 403 con motivo rateLimitExceeded/userRateLimitExceeded."""
+    status = e.resp.status
+    return status == 429 or (status == 403 and _error_reason(e) in RATE_LIMIT_REASONS)
+
+
+def should_retry(e: HttpError) -> bool:
+    return e.resp.status in RETRYABLE_STATUS or is_throttle(e)
+
+
+def retry_after(e: HttpError):
+    """Segundos pedidos en el encabezado Retry-After (número o fecha HTTP), o None."""
+    value = e.resp.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except Exception:
+            return None
+
+
+class RequestScheduler:
+    """
+    Todas las llamadas a Gmail pasan por aquí:
+      - token bucket en unidades de cuota (cada endpoint pesa lo que cuesta)
+      - reintentos con backoff exponencial con jitter, respetando Retry-After
+      - tasa adaptativa: se reduce a la mitad ante un 429 y sube de a poco
+        mientras las llamadas salen bien (AIMD)
+    Es thread-safe; los hilos del pipeline comparten el mismo.
+    """
+
+    def __init__(self, max_rate: float = USER_RATE_LIMIT, min_rate: float = 10.0,
+                 max_retries: int = 6, base_delay: float = 1.0, max_delay: float = 64.0):
+        self.max_rate = float(max_rate)
+        self.min_rate = float(min_rate)
+        self.rate = float(max_rate)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.throttled = 0
+        self._tokens = self.rate
+        self._last = time.monotonic()
+        self._last_cut = 0.0
+        self._lock = threading.Lock()
+
+    def configure(self, max_rate: float):
+        with self._lock:
+            self.max_rate = float(max_rate)
+            self.rate = min(self.rate, self.max_rate)
+
+    # --- token bucket ---
+    def acquire(self, units: float):
+        """
+        Reserva units del balde y espera lo necesario. El balde puede quedar en
+        negativo: los que llegan después esperan su turno (orden de llegada).
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= units
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+
+    # --- control adaptativo ---
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.01)
+
+    def on_throttle(self):
+        with self._lock:
+            self.throttled += 1
+            now = time.monotonic()
+            if now - self._last_cut >= 1.0:  # una sola reducción por ráfaga de 429
+                self.rate = max(self.min_rate, self.rate / 2)
+                self._last_cut = now
+
+    def backoff(self, attempt: int, wait_hint: float = None) -> float:
+        """Espera antes del reintento attempt (0, 1, ...): Retry-After si vino, si no full jitter."""
+        if wait_hint is not None:
+            delay = wait_hint + random.uniform(0, self.base_delay)
+        else:
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        time.sleep(delay)
+        return delay
+
+    # --- ejecución ---
+    def execute(self, request, endpoint: str, http=None, units: float = None):
+        """Ejecuta un HttpRequest de googleapiclient respetando cuota y reintentos."""
+        units = QUOTA_UNITS.get(endpoint, 5) if units is None else units
+        for attempt in range(self.max_retries + 1):
+            self.acquire(units)
+            METRICS.inc("gmail_api_calls_total", endpoint=endpoint)
+            t0 = time.perf_counter()
+            try:
+                response = request.execute(http=http)
+            except HttpError as e:
+                METRICS.observe("gmail_api_latency_seconds", time.perf_counter() - t0, endpoint=endpoint)
+                if not should_retry(e) or attempt == self.max_retries:
+                    raise
+                METRICS.inc("gmail_api_retries_total", endpoint=endpoint)
+                if is_throttle(e):
+                    self.on_throttle()
+                self.backoff(attempt, retry_after(e))
+                continue
+            METRICS.observe("gmail_api_latency_seconds", time.perf_counter() - t0, endpoint=endpoint)
+            self.on_success()
+            return response
+
+
+# Planificador compartido por todo el proceso
+SCHEDULER = RequestScheduler()
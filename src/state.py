@@ -1,8 +1,11 @@
-import os, json
+import os, json, glob, sqlite3, threading, time
 
 def _ensure_dir(path):
     os.makedirs(os.path.dirname(path), exist_ok=True)
 
+# -------------------------
+# Formato anterior (JSONL / .hashes.json): solo se lee para migrar
+# -------------------------
 def load_processed(path: str):
     seen = set()
     if os.path.exists(path):
@@ -21,3 +24,258 @@ def append_processed(path: str, keys: list):
     with open(path, "a", encoding="utf-8") as f:
         for k in keys:
             f.write(json.dumps({"key": k}) + "\n")
+
+# -------------------------
+# Estado indexado (SQLite)
+# -------------------------
+class StateStore:
+    """
+    Estado de dedupe en SQLite (WAL), con búsquedas puntuales en vez de cargar todo:
+      - processed: claves messageId:attachmentId ya procesadas
+      - hashes: tabla global de SHA-256 de contenido, con el lote y la ruta donde quedó
+      - listings: ids ya listados por query de días cerrados (no reciben correo nuevo)
+      - invoices: índice global de facturas por codigoGeneracion (del JSON del DTE)
+      - attachments: hash y ruta (relativa al lote) de cada adjunto guardado, para
+        enlazarlo desde el almacén de blobs en otros lotes sin volver a bajarlo
+    Cada adjunto guardado se registra en su propia transacción durante la corrida.
+    Se puede usar desde varios hilos (las operaciones se serializan con un lock).
+    """
+
+    def __init__(self, path: str = "data/state/state.sqlite"):
+        _ensure_dir(path)
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)  # varias cuentas = varios procesos
+        self._lock = threading.Lock()
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS processed (key TEXT PRIMARY KEY) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS hashes (
+                sha256 TEXT NOT NULL,
+                lot TEXT NOT NULL,
+                path TEXT NOT NULL DEFAULT '',
+                PRIMARY KEY (sha256, lot)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS ix_hashes_lot ON hashes(lot);
+            CREATE TABLE IF NOT EXISTS listings (query TEXT PRIMARY KEY, ids TEXT NOT NULL) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS invoices (
+                codigo_generacion TEXT PRIMARY KEY,
+                numero_control TEXT NOT NULL DEFAULT '',
+                emisor_nit TEXT NOT NULL DEFAULT '',
+                message_id TEXT NOT NULL DEFAULT '',
+                lot TEXT,
+                path TEXT NOT NULL DEFAULT ''
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS attachments (
+                key TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL,
+                relpath TEXT NOT NULL
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS deliveries (
+                lot TEXT NOT NULL,
+                recipient TEXT NOT NULL,
+                arcname TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                sent_at REAL NOT NULL,
+                PRIMARY KEY (lot, recipient, arcname)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v TEXT);
+            """
+        )
+        self._db.commit()
+
+    # --- claves procesadas ---
+    def is_processed(self, key: str) -> bool:
+        with self._lock:
+            row = self._db.execute("SELECT 1 FROM processed WHERE key = ?", (key,)).fetchone()
+        return row is not None
+
+    def mark_processed(self, keys):
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR IGNORE INTO processed (key) VALUES (?)", [(k,) for k in keys])
+
+    # --- hashes de contenido ---
+    def hash_in_lot(self, sha256: str, lot: str) -> bool:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT 1 FROM hashes WHERE sha256 = ? AND lot = ?", (sha256, lot)
+            ).fetchone()
+        return row is not None
+
+    def lots_for_hash(self, sha256: str) -> list:
+        with self._lock:
+            rows = self._db.execute("SELECT lot, path FROM hashes WHERE sha256 = ?", (sha256,)).fetchall()
+        return [{"lot": lot, "path": path} for lot, path in rows]
+
+    def record_saved(self, key: str, sha256: str, lot: str, path: str, dte: dict = None, relpath: str = None):
+        """
+        Adjunto guardado: clave procesada + hash en el lote (+ la factura en el índice
+        si es el JSON de un DTE, + su ruta en el lote si está en el almacén de blobs),
+        en una sola transacción.
+        """
+        with self._lock, self._db:
+            self._db.execute("INSERT OR IGNORE INTO processed (key) VALUES (?)", (key,))
+            self._db.execute(
+                "INSERT OR REPLACE INTO hashes (sha256, lot, path) VALUES (?, ?, ?)",
+                (sha256, lot, path),
+            )
+            if relpath:
+                self._db.execute(
+                    "INSERT OR IGNORE INTO attachments (key, sha256, relpath) VALUES (?, ?, ?)",
+                    (key, sha256, relpath),
+                )
+            if dte:
+                self._db.execute(
+                    "INSERT OR IGNORE INTO invoices "
+                    "(codigo_generacion, numero_control, emisor_nit, message_id, lot, path) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (dte["codigo_generacion"], dte["numero_control"], dte["emisor_nit"],
+                     key.split(":", 1)[0], lot, path),
+                )
+
+    def saved_attachment(self, key: str):
+        """{sha256, relpath} de un adjunto ya guardado (None si no se registró)."""
+        with self._lock:
+            row = self._db.execute("SELECT sha256, relpath FROM attachments WHERE key = ?", (key,)).fetchone()
+        return {"sha256": row[0], "relpath": row[1]} if row else None
+
+    # --- índice de facturas (DTE) ---
+    def invoice_known(self, codigo_generacion: str):
+        """Factura ya registrada con ese codigoGeneracion: {numero_control, emisor_nit, message_id, lot, path} o None."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT numero_control, emisor_nit, message_id, lot, path FROM invoices "
+                "WHERE codigo_generacion = ?", (codigo_generacion,)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("numero_control", "emisor_nit", "message_id", "lot", "path"), row))
+
+    # --- listados de días cerrados ---
+    def get_listing(self, query: str):
+        """Ids guardados para una query de un tramo ya cerrado (None si no hay)."""
+        with self._lock:
+            row = self._db.execute("SELECT ids FROM listings WHERE query = ?", (query,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_listing(self, query: str, ids: list):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO listings (query, ids) VALUES (?, ?)",
+                (query, json.dumps(ids)),
+            )
+
+    # --- envíos (qué archivos de cada lote ya recibió cada destinatario) ---
+    def delivered(self, lot: str, recipient: str) -> dict:
+        """{ruta dentro del ZIP: tamaño} de lo ya enviado a recipient de ese lote."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT arcname, size FROM deliveries WHERE lot = ? AND recipient = ?", (lot, recipient)
+            ).fetchall()
+        return dict(rows)
+
+    def record_delivery(self, lot: str, recipient: str, files: dict):
+        """Anota files ({arcname: tamaño}) como enviados; se llama recién cuando el correo salió."""
+        now = time.time()
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO deliveries (lot, recipient, arcname, size, sent_at) VALUES (?, ?, ?, ?, ?)",
+                [(lot, recipient, arc, size, now) for arc, size in files.items()],
+            )
+
+    # --- mantenimiento ---
+    def migrate_legacy(self, processed_jsonl: str, downloads_dir: str) -> bool:
+        """
+        Importa una sola vez processed.jsonl y los .hashes.json de cada lote.
+        Los archivos viejos no se tocan.
+        """
+        if self._db.execute("SELECT 1 FROM meta WHERE k = 'legacy_migrated'").fetchone():
+            return False
+        keys = load_processed(processed_jsonl)
+        keys.discard(None)
+        rows = []
+        for hashes_path in glob.glob(os.path.join(downloads_dir, "*", ".hashes.json")):
+            lot = os.path.basename(os.path.dirname(hashes_path))
+            with open(hashes_path, "r", encoding="utf-8") as f:
+                try:
+                    rows.extend((h, lot) for h in json.load(f))
+                except Exception:
+                    pass
+        with self._db:
+            self._db.executemany("INSERT OR IGNORE INTO processed (key) VALUES (?)", [(k,) for k in keys])
+            self._db.executemany("INSERT OR IGNORE INTO hashes (sha256, lot) VALUES (?, ?)", rows)
+            # OR IGNORE: dos procesos/jobs abriendo un estado nuevo a la vez migran ambos (es idempotente)
+            self._db.execute("INSERT OR IGNORE INTO meta (k, v) VALUES ('legacy_migrated', '1')")
+        return True
+
+    def compact(self) -> int:
+        """
+        Quita hashes cuyos archivos ya no existen en disco, hace checkpoint del WAL
+        y VACUUM. Devuelve cuántas filas de hashes se borraron.
+        """
+        gone = [
+            (h, lot)
+            for h, lot, path in self._db.execute("SELECT sha256, lot, path FROM hashes WHERE path != ''").fetchall()
+            if not os.path.exists(path)
+        ]
+        with self._db:
+            self._db.executemany("DELETE FROM hashes WHERE sha256 = ? AND lot = ?", gone)
+        self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self._db.execute("VACUUM")
+        return len(gone)
+
+    def close(self):
+        self._db.close()
+
+
+def open_state(state_dir: str = "data/state", output_dir: str = "data") -> StateStore:
+    """Abre el estado indexado y migra (una vez) el formato JSONL/JSON anterior."""
+    store = StateStore(os.path.join(state_dir, "state.sqlite"))
+    store.migrate_legacy(
+        os.path.join(state_dir, "processed.jsonl"),
+        os.path.join(output_dir, "downloads"),
+    )
+    return store
+
+
+# -------------------------
+# Sync incremental
+# -------------------------
+def load_sync_state(path: str) -> dict:
+    """
+    Estado de sincronización incremental por query:
+    {query: {"history_id": "...", "ids": [...]}}
+    """
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            try:
+                return json.load(f)
+            except Exception:
+                return {}
+    return {}
+
+def save_sync_state(path: str, sync: dict):
+    _ensure_dir(path)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(sync, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+if __name__ == "__main__":
+    # Mantenimiento: python src/state.py migrate|compact
+    import argparse
+    ap = argparse.ArgumentParser(description="Mantenimiento del estado de dedupe (SQLite).")
+    ap.add_argument("command", choices=["migrate", "compact"])
+    ap.add_argument("--state-dir", default="data/state")
+    ap.add_argument("--output-dir", default="data")
+    args = ap.parse_args()
+
+    store = open_state(args.state_dir, args.output_dir)
+    if args.command == "compact":
+        removed = store.compact()
+        print(f"Compactado: {removed} hashes huérfanos eliminados")
+    else:
+        print("Migración lista")
+    store.close()
@@ -1,7 +1,9 @@
 # src/storage.py
-import os, csv, re, json, zipfile, hashlib
+import os, io, csv, re, json, shutil, zipfile, hashlib, base64, tempfile, time
 from datetime import datetime
+from functools import lru_cache
 from typing import List, Dict
+from metrics import METRICS
 
 # -------------------------
 # Directorios de salida
@@ -16,51 +18,58 @@ def ensure_lot_dir(base_output_dir: str, date_from: str, date_to: str) -> str:
     os.makedirs(lot_dir, exist_ok=True)
     return lot_dir
 
-def build_message_folder_name(message) -> str:
+def build_message_folder_name(ymd: str, subject: str, message_id: str) -> str:
     """
     Nombre de subcarpeta por mensaje: YYYYMMDD_<asunto_sanitizado_40>_<id8>
     """
-    headers = {h["name"].lower(): h["value"] for h in message.get("payload", {}).get("headers", [])}
-    subj = headers.get("subject", "(sin asunto)")
-    ymd  = _yyyymmdd_from_internal_date(message.get("internalDate", 0))
-    subj_clean = _sanitize(subj)[:40] or "sin_asunto"
-    suf = str(message.get("id", ""))[-8:]
+    subj_clean = _sanitize(subject)[:40] or "sin_asunto"
+    suf = str(message_id or "")[-8:]
     return f"{ymd}_{subj_clean}_{suf}"
 
-def ensure_message_dir(lot_dir: str, message) -> str:
+def message_names(message_id: str, internal_date, subject: str, from_header: str) -> tuple:
+    """(YYYYMMDD, remitente corto, subcarpeta) de un mensaje: se calculan una vez al parsearlo (message.py)."""
+    ymd = _yyyymmdd_from_internal_date(internal_date or 0)
+    return ymd, _extract_sender_name(from_header), build_message_folder_name(ymd, subject, message_id)
+
+def ensure_message_dir(lot_dir: str, rec) -> str:
     """
-    Crea (si no existe) la subcarpeta para ese mensaje dentro del lote.
+    Crea (si no existe) la subcarpeta para ese mensaje (message.MessageRecord) dentro del lote.
     """
-    msg_folder = build_message_folder_name(message)
-    msg_dir = os.path.join(lot_dir, msg_folder)
+    msg_dir = os.path.join(lot_dir, rec.folder)
     os.makedirs(msg_dir, exist_ok=True)
     return msg_dir
 
 # -------------------------
 # Helpers de nombres
 # -------------------------
+_ACCENTS = str.maketrans("áéíóúÁÉÍÓÚñÑ", "aeiouAEIOUnN")
+_RE_SYMBOLS = re.compile(r"[^\w\s.-]+", flags=re.UNICODE)
+_RE_SPACES = re.compile(r"\s+")
+_RE_DISPLAY_NAME = re.compile(r'^"?([^"<]+?)"?\s*<')
+_RE_MAILBOX = re.compile(r'([^@<\s]+)@')
+
 def _sanitize(text: str) -> str:
     """
     Sanitiza para nombres de archivo: quita tildes, símbolos raros y espacios dobles.
     """
     if not text:
         return "desconocido"
-    mapping = str.maketrans("áéíóúÁÉÍÓÚñÑ", "aeiouAEIOUnN")
-    text = text.translate(mapping)
-    text = re.sub(r"[^\w\s.-]+", "", text, flags=re.UNICODE)
-    text = re.sub(r"\s+", "_", text).strip("_")
+    text = text.translate(_ACCENTS)
+    text = _RE_SYMBOLS.sub("", text)
+    text = _RE_SPACES.sub("_", text).strip("_")
     return text or "desconocido"
 
+@lru_cache(maxsize=4096)  # los remitentes se repiten mucho (mismos proveedores cada mes)
 def _extract_sender_name(from_header: str) -> str:
     """
     Intenta obtener un nombre corto del remitente (display name o parte antes de @).
     """
     if not from_header:
         return "remitente"
-    m = re.search(r'^"?([^"<]+?)"?\s*<', from_header)
+    m = _RE_DISPLAY_NAME.search(from_header)
     if m:
         return _sanitize(m.group(1))
-    m = re.search(r'([^@<\s]+)@', from_header)
+    m = _RE_MAILBOX.search(from_header)
     return _sanitize(m.group(1) if m else "remitente")
 
 def _yyyymmdd_from_internal_date(internal_ms: int) -> str:
@@ -70,64 +79,230 @@ def _yyyymmdd_from_internal_date(internal_ms: int) -> str:
     dt = datetime.utcfromtimestamp(int(internal_ms) / 1000.0)
     return dt.strftime("%Y%m%d")
 
-def build_standard_filename(message, original_filename: str) -> str:
+def build_standard_filename(rec, original_filename: str) -> str:
     """
-    Construye un nombre estándar conservando la extensión original:
-    YYYYMMDD_Proveedor_original.ext
+    Construye un nombre estándar conservando la extensión original
+    (rec: message.MessageRecord): YYYYMMDD_Proveedor_original.ext
     """
-    headers = {h["name"].lower(): h["value"] for h in message.get("payload", {}).get("headers", [])}
-    sender = _extract_sender_name(headers.get("from", ""))
-    ymd = _yyyymmdd_from_internal_date(message.get("internalDate", 0))
-    base = f"{ymd}_{sender}_{original_filename}"
-    base = _sanitize(base)
-    return base
+    return _sanitize(f"{rec.ymd}_{rec.sender_name}_{original_filename}")
 
 # -------------------------
 # Guardado y reporte
 # -------------------------
+def _unique_path(dir_path: str, filename: str, dir_names: dict = None) -> str:
+    """
+    Ruta libre para filename dentro de dir_path (agrega (2), (3)... si ya existe).
+    dir_names: {carpeta: nombres} de la corrida (lo arma run_pipeline); así cada carpeta
+    se lista una sola vez y se recuerdan los nombres asignados. Vive lo que la corrida:
+    en la UI o el daemon, una corrida siguiente vuelve a mirar el disco.
+    """
+    names = dir_names.get(dir_path) if dir_names is not None else None
+    if names is None:
+        names = set(os.listdir(dir_path))
+        if dir_names is not None:
+            dir_names[dir_path] = names
+    candidate = filename
+    stem, ext = os.path.splitext(filename)
+    i = 2
+    while candidate in names:
+        candidate = f"{stem}({i}){ext}"
+        i += 1
+    names.add(candidate)
+    return os.path.join(dir_path, candidate)
+
 def save_pdf_bytes(dir_path: str, filename: str, data: bytes) -> str:
     """
     Guarda bytes en disco (para .pdf o .json). Si el archivo existe, agrega sufijo incremental.
     """
-    path = os.path.join(dir_path, filename)
-    if os.path.exists(path):
-        stem, ext = os.path.splitext(filename)
-        i = 2
-        while True:
-            candidate = os.path.join(dir_path, f"{stem}({i}){ext}")
-            if not os.path.exists(candidate):
-                path = candidate
-                break
-            i += 1
+    path = _unique_path(dir_path, filename)
     with open(path, "wb") as f:
         f.write(data)
     return path
 
-def append_csv_report(dir_path: str, rows: List[Dict], filename: str = "reporte.csv") -> str:
+# -------------------------
+# Guardado en streaming
+# -------------------------
+STREAM_CHUNK = 1024 * 1024  # bytes decodificados por bloque
+
+def ensure_tmp_dir(lot_dir: str) -> str:
+    """
+    Carpeta de temporales del lote (mismo filesystem que los destinos, así el
+    rename es atómico). Borra restos de corridas interrumpidas de hace más de 1 h.
+    """
+    tmp_dir = os.path.join(lot_dir, ".tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    limit = time.time() - 3600
+    for name in os.listdir(tmp_dir):
+        path = os.path.join(tmp_dir, name)
+        try:
+            if os.path.getmtime(path) < limit:
+                os.remove(path)
+        except OSError:
+            pass
+    return tmp_dir
+
+def stream_b64_to_temp(tmp_dir: str, b64data: str, chunk_size: int = STREAM_CHUNK) -> Dict:
+    """
+    Decodifica base64url por bloques, calcula el SHA-256 a medida que escribe
+    a un temporal y devuelve {tmp_path, sha256, size}. La memoria extra queda
+    acotada por chunk_size. Después: commit_temp() o discard_temp().
+    """
+    h = hashlib.sha256()
+    size = 0
+    step = chunk_size // 3 * 4  # múltiplo de 4 caracteres base64
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir, prefix="part-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for i in range(0, len(b64data), step):
+                chunk = base64.urlsafe_b64decode(b64data[i:i + step])
+                h.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+    except BaseException:
+        discard_temp(tmp_path)
+        raise
+    METRICS.inc("bytes_written_total", size)
+    return {"tmp_path": tmp_path, "sha256": h.hexdigest(), "size": size}
+
+def _place(dir_path: str, filename: str, create, dir_names: dict = None) -> str:
+    """
+    Crea el archivo final con create(path) en un nombre libre. _unique_path solo sabe
+    de esta corrida: si otra (otra cuenta, ver accounts.py) ganó el nombre, create
+    falla con FileExistsError y se prueba el siguiente.
+    """
+    while True:
+        path = _unique_path(dir_path, filename, dir_names)
+        try:
+            create(path)
+            return path
+        except FileExistsError:
+            continue
+
+def _file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(STREAM_CHUNK), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _already_there(dir_path: str, filename: str, sha256: str):
+    """
+    Ruta del archivo si ya está en el lote con ese mismo contenido (lo dejó una corrida
+    que se cortó antes de registrarlo): se reusa en vez de crear "nombre(2)".
+    """
+    path = os.path.join(dir_path, filename)
+    if sha256 and os.path.isfile(path) and _file_sha256(path) == sha256:
+        return path
+    return None
+
+def commit_temp(tmp_path: str, dir_path: str, filename: str, sha256: str = None, blobs=None,
+                dir_names: dict = None) -> str:
+    """
+    Mueve el temporal a su nombre final (rename atómico) y devuelve la ruta.
+    Con blobs (blobs.BlobStore) el contenido va al almacén y en el lote queda un enlace.
+    dir_names: nombres ya vistos en la corrida (ver _unique_path).
+    """
+    if blobs is not None:
+        blobs.put_temp(tmp_path, sha256)
+        return link_blob(blobs, sha256, dir_path, filename, dir_names)
+    existing = _already_there(dir_path, filename, sha256)
+    if existing:
+        discard_temp(tmp_path)
+        return existing
+
+    def _move(path):
+        os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))  # reserva el nombre
+        os.replace(tmp_path, path)
+    return _place(dir_path, filename, _move, dir_names)
+
+def link_blob(blobs, sha256: str, dir_path: str, filename: str, dir_names: dict = None) -> str:
+    """Pone en el lote un blob ya guardado (hardlink, reflink o copia) y devuelve la ruta."""
+    os.makedirs(dir_path, exist_ok=True)
+    existing = _already_there(dir_path, filename, sha256)
+    if existing:
+        return existing
+    return _place(dir_path, filename, lambda path: blobs.link(sha256, path), dir_names)
+
+def discard_temp(tmp_path: str):
+    try:
+        os.remove(tmp_path)
+    except FileNotFoundError:
+        pass
+
+def write_csv_report(dir_path: str, rows: List[Dict], fieldnames: List[str], filename: str = "reporte.csv") -> str:
     """
-    Agrega filas al CSV del lote. Crea encabezados si no existe.
-    Campos esperados en cada row:
-      fecha, remitente, asunto, archivo_local, messageId, attachmentId
+    Escribe el CSV del lote completo (no agrega): se arma en un temporal y se
+    reemplaza de una vez, así volver a correr no duplica filas.
     """
     csv_path = os.path.join(dir_path, filename)
-    file_exists = os.path.exists(csv_path)
-    fieldnames = ["fecha", "remitente", "asunto", "archivo_local", "messageId", "attachmentId"]
-
-    with open(csv_path, "a", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        if not file_exists:
-            writer.writeheader()
-        for r in rows:
-            writer.writerow(r)
+    tmp_path = csv_path + ".tmp"
+    with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmp_path, csv_path)
     return csv_path
 
 # -------------------------
-# ZIP del lote (recursivo)
+# ZIP del lote (recursivo, incremental)
 # -------------------------
+# PDFs ya vienen comprimidos: deflate casi no reduce tamaño y gasta CPU
+ZIP_STORED_EXTS = (".pdf",)
+
+def _zip_compression(arcname: str) -> int:
+    return zipfile.ZIP_STORED if arcname.lower().endswith(ZIP_STORED_EXTS) else zipfile.ZIP_DEFLATED
+
+def _zip_sources(lot_dir: str) -> Dict:
+    """PDFs/JSONs y reporte.csv del lote: {arcname: (ruta, tamaño, mtime_ns)}."""
+    sources = {}
+    for root, dirs, files in os.walk(lot_dir):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]  # .tmp y similares
+        for fname in files:
+            low = fname.lower()
+            if low.endswith((".pdf", ".json")) or fname == "reporte.csv":
+                full = os.path.join(root, fname)
+                st = os.stat(full)
+                arc = os.path.relpath(full, lot_dir).replace(os.sep, "/")  # conserva subcarpetas
+                sources[arc] = (full, st.st_size, st.st_mtime_ns)
+    return sources
+
+def _write_entry(zf: zipfile.ZipFile, path: str, arcname: str):
+    """Agrega un archivo al ZIP por bloques, con la compresión que le toca según su tipo."""
+    zinfo = zipfile.ZipInfo.from_file(path, arcname=arcname)
+    zinfo.compress_type = _zip_compression(arcname)
+    with open(path, "rb") as src, zf.open(zinfo, "w") as dst:
+        shutil.copyfileobj(src, dst, STREAM_CHUNK)
+
+def _copy_entry(src: zipfile.ZipFile, info: zipfile.ZipInfo, dst: zipfile.ZipFile):
+    """Copia una entrada de un ZIP a otro (descomprime y vuelve a comprimir igual)."""
+    zinfo = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+    zinfo.compress_type = info.compress_type
+    zinfo.external_attr = info.external_attr
+    zinfo.file_size = info.file_size
+    with src.open(info) as fsrc, dst.open(zinfo, "w") as fdst:
+        shutil.copyfileobj(fsrc, fdst, STREAM_CHUNK)
+
+def _load_zip_manifest(zip_path: str):
+    """Manifiesto {arcname: [tamaño, mtime_ns]} del ZIP existente, en el orden del archivo."""
+    path = zip_path + ".manifest.json"
+    if not (os.path.exists(zip_path) and os.path.exists(path)):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        try:
+            return json.load(f)
+        except Exception:
+            return None
+
 def make_zip(lot_dir: str, zip_out_dir: str = None, zip_name: str = None) -> str:
     """
     Comprime PDFs/JSONs (y reporte.csv) del lote de forma recursiva, preservando subcarpetas.
     Devuelve la ruta del .zip.
+
+    Es incremental: un manifiesto junto al ZIP recuerda tamaño/mtime de cada entrada.
+    Si todas siguen iguales, solo se agregan las nuevas al final. Si algo cambió o se
+    borró, se arma el ZIP de nuevo en un temporal: las entradas previas a la primera
+    vieja se copian del ZIP anterior y el resto se lee del lote (reporte.csv va al final
+    a propósito). PDFs se guardan sin comprimir; JSON/CSV con deflate.
     """
     base_dir = os.path.dirname(lot_dir)
     zip_out_dir = zip_out_dir or os.path.join(base_dir, "out")
@@ -137,33 +312,152 @@ def make_zip(lot_dir: str, zip_out_dir: str = None, zip_name: str = None) -> str
     zip_name = zip_name or f"{lot_basename}.zip"
     zip_path = os.path.join(zip_out_dir, zip_name)
 
-    with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
-        for root, _, files in os.walk(lot_dir):
-            for fname in files:
-                low = fname.lower()
-                if low.endswith((".pdf", ".json")) or fname == "reporte.csv":
-                    full = os.path.join(root, fname)
-                    arc  = os.path.relpath(full, lot_dir)  # conserva subcarpetas
-                    zf.write(full, arcname=arc)
+    sources = _zip_sources(lot_dir)
+    order = sorted(sources, key=lambda arc: (arc == "reporte.csv", arc))
+
+    # ¿Cuántas entradas del ZIP actual siguen vigentes?
+    names, keep = [], 0
+    manifest = _load_zip_manifest(zip_path)
+    if manifest is not None:
+        try:
+            with zipfile.ZipFile(zip_path) as zf:
+                names = [i.filename for i in zf.infolist()]
+        except zipfile.BadZipFile:
+            names = []
+        if names == list(manifest):
+            for arc in names:
+                src = sources.get(arc)
+                if src is None or manifest[arc] != [src[1], src[2]]:
+                    break
+                keep += 1
+        else:
+            names = []
+
+    kept = set(names[:keep])
+    pending = [arc for arc in order if arc not in kept]
+    if names and keep == len(names):
+        # todo lo que hay sigue vigente: solo se agrega lo nuevo al final
+        with zipfile.ZipFile(zip_path, "a") as zf:
+            for arc in pending:
+                _write_entry(zf, sources[arc][0], arc)
+    else:
+        # algo cambió o se borró: se arma otro ZIP en un temporal con las entradas que
+        # siguen vigentes (copiadas del viejo) más las nuevas, y se reemplaza de una vez
+        fd, tmp_path = tempfile.mkstemp(dir=zip_out_dir, prefix=".zip-", suffix=".tmp")
+        os.close(fd)
+        try:
+            with zipfile.ZipFile(tmp_path, "w") as zf:
+                if keep:
+                    with zipfile.ZipFile(zip_path) as old:
+                        for info in old.infolist()[:keep]:
+                            _copy_entry(old, info, zf)
+                for arc in pending:
+                    _write_entry(zf, sources[arc][0], arc)
+            os.replace(tmp_path, zip_path)
+        except BaseException:
+            discard_temp(tmp_path)
+            raise
+    written = names[:keep] + pending
+
+    METRICS.inc("zip_entries_total", keep, result="kept")
+    METRICS.inc("zip_entries_total", len(pending), result="written")
+    METRICS.inc("bytes_zipped_total", sum(sources[arc][1] for arc in pending))
+
+    with open(zip_path + ".manifest.json", "w", encoding="utf-8") as f:
+        json.dump({arc: [sources[arc][1], sources[arc][2]] for arc in written}, f, ensure_ascii=False)
     return zip_path
 
+def zip_contents(zip_path: str) -> Dict:
+    """{arcname: tamaño} de los PDFs/JSONs de un ZIP hecho con make_zip (según su manifiesto)."""
+    manifest = _load_zip_manifest(zip_path) or {}
+    return {arc: v[0] for arc, v in manifest.items() if arc != "reporte.csv"}
+
+# -------------------------
+# ZIP delta: solo lo que el destinatario no recibió, en partes con tope de tamaño
+# -------------------------
+ZIP_ENTRY_OVERHEAD = 256  # bytes aprox. por entrada (header local + directorio central)
+DELTA_CSV = "reporte_delta.csv"
+
+def _plan_parts(files: List, max_bytes: int) -> List:
+    """
+    Reparte [(arcname, ruta, tamaño)] en partes de hasta max_bytes. Los archivos de un
+    mismo mensaje (misma subcarpeta: PDF + JSON) van siempre en la misma parte; un
+    mensaje que solo ya pasa el tope va en una parte para él.
+    """
+    groups = {}
+    for f in files:
+        groups.setdefault(f[0].split("/")[0], []).append(f)
+    parts, current, size = [], [], 0
+    for group in groups.values():
+        group_size = sum(f[2] + ZIP_ENTRY_OVERHEAD for f in group)
+        if current and size + group_size > max_bytes:
+            parts.append(current)
+            current, size = [], 0
+        current += group
+        size += group_size
+    if current:
+        parts.append(current)
+    return parts
+
+def _report_rows(lot_dir: str):
+    """(columnas, [(arcnames de la fila, fila)]) de reporte.csv del lote; ([], []) si no hay reporte."""
+    csv_path = os.path.join(lot_dir, "reporte.csv")
+    if not os.path.exists(csv_path):
+        return [], []
+    lot_abs = os.path.abspath(lot_dir)
+
+    def _arc(path):
+        return os.path.relpath(os.path.abspath(path), lot_abs).replace(os.sep, "/") if path else None
+
+    with open(csv_path, "r", newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        rows = [({_arc(r.get("archivo_local"))}, r) for r in reader]
+        return reader.fieldnames or [], rows
+
+def _delta_csv(fieldnames: List, rows: List, arcnames) -> bytes:
+    """CSV con las filas del reporte cuyo archivo está en arcnames."""
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=fieldnames)
+    writer.writeheader()
+    writer.writerows(r for arcs, r in rows if arcs & arcnames)
+    return out.getvalue().encode("utf-8")
+
+def make_delta_zips(lot_dir: str, delivered: Dict, max_bytes: int, zip_out_dir: str = None) -> List:
+    """
+    ZIPs con los PDFs/JSONs del lote que no están en delivered ({arcname: tamaño}, ver
+    state.delivered), cada uno con su reporte_delta.csv (las filas de esos archivos).
+    Si no entran en max_bytes se parten en varios: <lote>_delta_<fecha>_parte1de3_<xxxx>.zip ...
+    (el sufijo al azar es para que dos envíos en el mismo segundo no se pisen).
+    Solo se leen y comprimen los archivos nuevos.
+    Devuelve [{path, files: {arcname: tamaño}, bytes}] (vacía si no hay nada nuevo).
+    """
+    zip_out_dir = zip_out_dir or os.path.join(os.path.dirname(lot_dir), "out")
+    os.makedirs(zip_out_dir, exist_ok=True)
+    sources = _zip_sources(lot_dir)
+    new = [(arc, full, size) for arc, (full, size, _) in sorted(sources.items())
+           if arc != "reporte.csv" and delivered.get(arc) != size]
+    plan = _plan_parts(new, max_bytes)
+    fieldnames, report_rows = _report_rows(lot_dir) if plan else ([], [])
+
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    base = f"{os.path.basename(lot_dir)}_delta_{stamp}"
+    parts = []
+    for k, files in enumerate(plan, 1):
+        prefix = f"{base}_parte{k}de{len(plan)}_" if len(plan) > 1 else f"{base}_"
+        fd, zip_path = tempfile.mkstemp(dir=zip_out_dir, prefix=prefix, suffix=".zip")
+        with os.fdopen(fd, "wb") as fh, zipfile.ZipFile(fh, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            for arc, full, _ in files:
+                zf.write(full, arcname=arc, compress_type=_zip_compression(arc))
+            if fieldnames:
+                zf.writestr(DELTA_CSV, _delta_csv(fieldnames, report_rows, {arc for arc, _, _ in files}))
+        METRICS.inc("zip_entries_total", len(files), result="written")
+        METRICS.inc("bytes_zipped_total", sum(size for _, _, size in files))
+        parts.append({"path": zip_path, "files": {arc: size for arc, _, size in files},
+                      "bytes": os.path.getsize(zip_path)})
+    return parts
+
 # -------------------------
 # Deduplicación por hash
 # -------------------------
 def sha256_bytes(data: bytes) -> str:
     return hashlib.sha256(data).hexdigest()
-
-def load_hash_index(lot_dir: str) -> set:
-    path = os.path.join(lot_dir, ".hashes.json")
-    if os.path.exists(path):
-        with open(path, "r", encoding="utf-8") as f:
-            try:
-                return set(json.load(f))
-            except Exception:
-                return set()
-    return set()
-
-def save_hash_index(lot_dir: str, hashes: set):
-    path = os.path.join(lot_dir, ".hashes.json")
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(sorted(list(hashes)), f, ensure_ascii=False)
@@ -0,0 +1,5 @@
+# tests/conftest.py
+import os, sys
+
+# los módulos de src/ se importan planos (from storage import ...), igual que en main.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
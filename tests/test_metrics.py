@@ -0,0 +1,9 @@
+# tests/test_metrics.py
+from metrics import Metrics
+
+
+def test_prometheus_escapes_label_values():
+    m = Metrics()
+    m.inc("errors_total", account='a\\b"c\nd')
+    line = [l for l in m.to_prometheus().splitlines() if l.startswith("dte_errors_total{")][0]
+    assert line == 'dte_errors_total{account="a\\\\b\\"c\\nd"} 1'
@@ -0,0 +1,44 @@
+# tests/test_storage.py
+import os, zipfile
+
+import storage
+
+
+def _lot(tmp_path):
+    lot_dir = tmp_path / "data" / "2026-01-01_a_2026-01-31"
+    for name in ("msg1", "msg2"):
+        (lot_dir / name).mkdir(parents=True)
+        (lot_dir / name / "factura.pdf").write_bytes(b"%PDF-1.4 " + name.encode() * 100)
+        (lot_dir / name / "factura.json").write_text('{"id": "%s"}' % name, encoding="utf-8")
+    return str(lot_dir)
+
+
+def test_delta_zips_same_second_dont_collide(tmp_path, monkeypatch):
+    lot_dir = _lot(tmp_path)
+    out = str(tmp_path / "out")
+    monkeypatch.setattr(storage.time, "strftime", lambda fmt: "20260101-120000")
+
+    first = storage.make_delta_zips(lot_dir, {}, max_bytes=10 * 1024 * 1024, zip_out_dir=out)
+    second = storage.make_delta_zips(lot_dir, {}, max_bytes=10 * 1024 * 1024, zip_out_dir=out)
+
+    assert len(first) == len(second) == 1
+    assert first[0]["path"] != second[0]["path"]
+    for part in first + second:
+        with zipfile.ZipFile(part["path"]) as zf:
+            assert sorted(zf.namelist()) == sorted(part["files"])
+        assert part["bytes"] == os.path.getsize(part["path"])
+
+
+def test_delta_zip_parts_same_second_dont_collide(tmp_path, monkeypatch):
+    lot_dir = _lot(tmp_path)
+    out = str(tmp_path / "out")
+    monkeypatch.setattr(storage.time, "strftime", lambda fmt: "20260101-120000")
+
+    # tope chico: cada mensaje (PDF + JSON) va en su propia parte
+    first = storage.make_delta_zips(lot_dir, {}, max_bytes=1, zip_out_dir=out)
+    second = storage.make_delta_zips(lot_dir, {}, max_bytes=1, zip_out_dir=out)
+
+    paths = [p["path"] for p in first + second]
+    assert len(first) == 2 and len(set(paths)) == 4
+    assert "_parte1de2_" in os.path.basename(first[0]["path"])
+    assert sorted(os.listdir(out)) == sorted(os.path.basename(p) for p in paths)
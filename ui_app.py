@@ -1,26 +1,35 @@
 # ui_app.py
 import streamlit as st
-import os, yaml
+import os, sys, time, yaml
 from datetime import date
 
-from src.filters import build_gmail_query
-from src.gmail_client import (
-    get_gmail_service, search_messages, get_message,
-    count_pdf_attachments, download_attachments
-)
-from src.storage import (
-    ensure_lot_dir, ensure_message_dir,
-    build_standard_filename, save_pdf_bytes,
-    append_csv_report, make_zip,
-    sha256_bytes, load_hash_index, save_hash_index
-)
-from src.state import load_processed, append_processed
-from src.mailer import send_mail_with_attachment
+# los módulos de src/ se importan entre sí como en el CLI (python src/main.py)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+from gmail_client import get_gmail_service
+from jobs import JobRunner
+from metrics import METRICS
 
 # cargar config
 with open("config/config.yaml", "r", encoding="utf-8") as f:
     CFG = yaml.safe_load(f)
 
+STATUS = {"queued": "⏳ En cola", "running": "▶️ Corriendo", "done": "✅ Listo",
+          "failed": "❌ Falló", "cancelled": "⏹️ Cancelado"}
+
+@st.cache_resource(show_spinner=False)
+def gmail_service():
+    """El servicio se arma una vez y sobrevive a los reruns de Streamlit."""
+    return get_gmail_service()
+
+@st.cache_resource(show_spinner=False)
+def job_runner():
+    """
+    Las corridas van en hilos propios, fuera del script: un rerun (cualquier clic)
+    no las corta ni las repite. Hay un solo runner para toda la app.
+    """
+    return JobRunner(gmail_service, CFG, max_jobs=CFG.get("ui_max_jobs", 2))
+
 st.set_page_config(page_title="DTE Bot – Descarga, ZIP y Envío", page_icon="🧾")
 
 st.title("🧾 DTE Bot – Descarga, ZIP y Envío")
@@ -34,90 +43,95 @@ with col2:
 do_download = st.checkbox("Descargar PDFs", value=True)
 do_zip = st.checkbox("Crear ZIP", value=True)
 do_send = st.checkbox("Enviar a contadora", value=False)
+do_delta = st.checkbox("Enviar solo lo nuevo (lo que la contadora aún no recibió de este rango)", value=False,
+                       disabled=not do_send)
 
 to_email = st.text_input(
     "Email contadora",
     value=os.getenv("CONTADORA_EMAIL") or CFG.get("contadora_email", "")
 )
 
+runner = job_runner()
+
 if st.button("Ejecutar"):
-    gmail = get_gmail_service()
-    query = build_gmail_query(
-        CFG["keywords"],
-        str(date_from),
-        str(date_to),
-    )
-    st.write("**Query usada:**", query)
-
-    ids = search_messages(gmail, query, max_results=CFG.get("max_results", 100))
-    st.write(f"Se encontraron {len(ids)} mensajes.")
-
-    lot_dir = ensure_lot_dir(CFG.get("output_dir", "data"), str(date_from), str(date_to))
-    state_path = "data/state/processed.jsonl"
-    seen = load_processed(state_path)
-    lot_hashes = load_hash_index(lot_dir)
-
-    csv_rows, processed_keys = [], []
-    total_pdfs = 0
-
-    progress = st.progress(0)
-    log_box = st.empty()
-
-    for i, mid in enumerate(ids, 1):
-        msg = get_message(gmail, mid)
-        headers = {h["name"].lower(): h["value"] for h in msg["payload"].get("headers", [])}
-        subj, frm = headers.get("subject", "(sin asunto)"), headers.get("from", "(sin remitente)")
-        pdfs = count_pdf_attachments(msg)
-        total_pdfs += pdfs
-
-        log_box.text(f"[{i}/{len(ids)}] PDFs:{pdfs} From:{frm} | {subj}")
-        progress.progress(i / len(ids))
-
-        atts = download_attachments(gmail, msg, exts=("pdf", "json"))
-        if do_download and atts:
-            msg_dir = ensure_message_dir(lot_dir, msg)
-            for a in atts:
-                key = f"{mid}:{a['attachment_id']}"
-                if key in seen:
-                    continue
-                h = sha256_bytes(a["data"])
-                if h in lot_hashes:
-                    processed_keys.append(key)
-                    continue
-                std = build_standard_filename(msg, a["filename"])
-                out = save_pdf_bytes(msg_dir, std, a["data"])
-                lot_hashes.add(h)
-                processed_keys.append(key)
-                csv_rows.append({
-                    "fecha": std[:8],
-                    "remitente": frm,
-                    "asunto": subj,
-                    "archivo_local": out,
-                    "messageId": mid,
-                    "attachmentId": a["attachment_id"],
-                })
-
-    if do_download and csv_rows:
-        csv_path = append_csv_report(lot_dir, csv_rows)
-        st.success(f"Reporte generado: {csv_path}")
-
-    zip_path = None
-    if do_zip or do_send:
-        zip_path = make_zip(lot_dir)
-        st.success(f"ZIP generado: {zip_path}")
-
-    if processed_keys:
-        append_processed(state_path, processed_keys)
-        save_hash_index(lot_dir, lot_hashes)
-
-    if do_send:
-        if not to_email:
-            st.error("Falta correo de contadora.")
-        else:
-            subject = f"Facturas DTE del {date_from} al {date_to}"
-            body = f"Adjunto ZIP del rango {date_from} a {date_to}.\nCarpeta: {lot_dir}"
-            send_mail_with_attachment(gmail, to_email, subject, body, zip_path)
-            st.success(f"Enviado a: {to_email}")
-
-    st.info(f"Total PDFs: {total_pdfs}")
-    st.balloons()
\ No newline at end of file
+    if do_send and not to_email:
+        st.error("Falta correo de contadora.")
+    else:
+        runner.submit({
+            "date_from": str(date_from), "date_to": str(date_to),
+            "download": do_download, "zip": do_zip, "send": do_send, "to_email": to_email,
+            "delta": do_send and do_delta,
+        })
+
+
+def _fmt_eta(seconds):
+    if seconds is None:
+        return "—"
+    return f"{seconds // 60} min {seconds % 60:02d} s" if seconds >= 60 else f"{seconds} s"
+
+
+def show_job(job):
+    p = job["params"]
+    st.markdown(f"**{p['date_from']} → {p['date_to']}** · {STATUS[job['status']]} · etapa: {job['stage']}")
+    done, total = job["messages"]
+    files_done, files_seen = job["files"]
+    st.progress(job["progress"], text=(
+        f"Mensajes {done}/{total} · adjuntos {files_done}/{files_seen} · "
+        f"{job['bytes_saved'] / (1024 * 1024):.1f} MB · ETA {_fmt_eta(job['eta_s'])}"
+    ))
+    if job["upload"]:
+        sent, size = job["upload"]
+        frac = sent / size if size else 1.0
+        st.progress(frac, text=f"Subiendo ZIP… {frac:.0%}")
+    if job["status"] in ("queued", "running"):
+        if job["cancel_requested"]:
+            st.caption("Cancelando… (termina lo que está en curso)")
+        elif st.button("Cancelar", key=f"cancel-{job['id']}"):
+            runner.cancel(job["id"])
+    if job["error"]:
+        st.error(job["error"])
+    summary = job["summary"]
+    if summary and job["status"] in ("done", "cancelled"):
+        st.info(
+            f"Total PDFs: {summary['total_pdfs']} · guardados: {summary['saved']} · "
+            f"Caché de mensajes: {summary['cache_hits']} aciertos, {summary['cache_misses']} pedidos a Gmail"
+        )
+        if summary.get("csv_path"):
+            st.success(f"Reporte generado: {summary['csv_path']}")
+        if job["zip_path"]:
+            st.success(f"ZIP generado: {job['zip_path']}")
+        if job["status"] == "done" and p.get("send"):
+            if job["sent_parts"] == 0:
+                st.info(f"Nada nuevo para {p['to_email']}: ya recibió todo lo de este rango")
+            else:
+                parts = f" ({job['sent_parts']} correos)" if job["sent_parts"] and job["sent_parts"] > 1 else ""
+                st.success(f"Enviado a: {p['to_email']}{parts}")
+    with st.expander("Log"):
+        st.text("\n".join(job["log"][-20:]))
+
+
+def jobs_panel(was_active=None):
+    # run_every queda fijo al crear el fragmento: si las corridas arrancaron o
+    # terminaron desde entonces, rerun de toda la app para armarlo de nuevo
+    if was_active is not None and runner.active() != was_active:
+        st.rerun()
+    jobs = runner.jobs()
+    if not jobs:
+        return
+    st.subheader("Corridas")
+    for job in jobs:
+        with st.container(border=True):
+            show_job(job)
+    with st.expander("Métricas (acumuladas desde que arrancó la app)"):
+        st.json(METRICS.snapshot())
+
+
+# El panel se refresca solo mientras haya corridas activas
+if hasattr(st, "fragment"):
+    active = runner.active()
+    st.fragment(run_every=1.0 if active else None)(jobs_panel)(active)
+else:
+    jobs_panel()
+    if runner.active():
+        time.sleep(1.0)
+        st.rerun()